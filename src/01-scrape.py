@@ -1,36 +1,54 @@
-from requests_html import HTMLSession
 # from folder called utils and file called scraper-utils.py import the functions get_data and parse_html
-from utils.scraper import get_data, parse_html, collect_property_links
-from utils.storage import save_to_parquet, load_parquet
+from utils.scraper import get_data, parse_html
+from utils.crawler import collect_property_links_adaptive
+from utils.storage import save_to_parquet, load_parquet, RecordLog
+from utils.http_cache import HttpCache
+from utils.session import make_session, CircuitOpenError
+from utils.metrics import METRICS
+from utils.sharding import parse_shard_arguments, work_units, units_for_shard, shard_path, location_url
 import pandas as pd
 import os
 import logging
-import time
-import random
 
 def main():
+    # with --num-shards N every (location, living area range) unit is assigned to one of N workers by
+    # a hash, and each worker writes its own shard of the outputs; src/014-merge-shards.py merges them
+    args = parse_shard_arguments("Collect and scrape every listing for one or more hemnet locations.")
     # Step 1: Collect the links to the properties
-    # create a new HTML session
-    session = HTMLSession()
+    # create a new HTML session, sharing one HTTP cache with the link collector. The session paces
+    # its own requests and backs off when hemnet starts answering with 429s or 5xx errors
+    cache = HttpCache()
+    session = make_session('listing', cache=cache)
     # initiate logging
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
     # set the params
-    base_url = "https://www.hemnet.se/salda/bostader?location_ids%5B%5D=17989"
     min_area = 60
     max_area = 65
-    step = 5
+    # the living area is split into ranges that each fit under hemnet's pagination cap, starting
+    # from ranges this wide, and the probed result counts are kept here between runs
+    initial_step = 50
+    # (one file per shard, so workers running side by side don't overwrite each other's counts)
+    counts_file = shard_path("data/interim/area_range_counts.json", args.shard, args.num_shards)
+    # fetch up to this many search pages at once, and at most this many requests per second
+    concurrency = 8
+    qps = 2.0
 
     # Get the date 
     date = pd.Timestamp.now().strftime("%Y-%m-%d")
 
     # property links file
-    property_links_file = f"output/hemnet_links_{date}.parquet"
+    property_links_file = shard_path(f"output/hemnet_links_{date}.parquet", args.shard, args.num_shards)
 
     # collect the property links if the file does not exist
     if not os.path.exists(property_links_file):
-        property_links = collect_property_links(base_url, min_area, max_area, step)
-        df_links = pd.DataFrame(property_links, columns=['url'])
+        units = units_for_shard(work_units(args.locations, min_area, max_area, initial_step), args.shard, args.num_shards)
+        logging.info(f"Shard {args.shard} of {args.num_shards}: {len(units)} (location, area range) units")
+        property_links = []
+        for location_id, unit_min_area, unit_max_area in units:
+            property_links += collect_property_links_adaptive(location_url(location_id), unit_min_area, unit_max_area, initial_step=initial_step,
+                                                              counts_file=counts_file, concurrency=concurrency, qps=qps, cache=cache)
+        df_links = pd.DataFrame(property_links, columns=['url']).drop_duplicates()
         save_to_parquet(df_links, property_links_file)
     else:
         df_links = load_parquet(property_links_file)
@@ -39,41 +57,59 @@ def main():
     
     # ensure output folder exists
     os.makedirs('output', exist_ok=True)
-    save_to_parquet(df_links, f'output/hemnet_links_{date}.parquet')
+    save_to_parquet(df_links, property_links_file)
 
     # Step 2: Collect the data from the property links
     # Create cache file in the output folder
-    cache_file = f'output/hemnet_properties_cache_{date}.parquet'
+    cache_file = shard_path(f'output/hemnet_properties_cache_{date}.parquet', args.shard, args.num_shards)
     
-    property_data_cache = load_parquet(cache_file)
+    # only the urls are needed to know what is already scraped
+    property_data_cache = load_parquet(cache_file, columns=['url'])
+    # parsed listings go to an append-only log, flushed every few records and moved into the cache
+    # file in batches, instead of rewriting the whole cache after every url
+    record_log = RecordLog(cache_file.replace('.parquet', '.log.jsonl'), batch_size=25)
+    compact_every = 250
+    scraped_urls = record_log.urls()
+    if not property_data_cache.empty:
+        scraped_urls |= set(property_data_cache['url'])
+    del property_data_cache
 
     for index, row in df_links.iterrows():
         try:
             url = row['url']
             
-            if not property_data_cache.empty and url in property_data_cache['url'].values:
+            if url in scraped_urls:
                 logging.info(f"Skipping already scraped URL: {url}")
                 continue
 
             r = session.get(url)
-            data = parse_html(r.html.html)
+            with METRICS.timer('parse'):
+                data = parse_html(r.html.html)
             # add the url to the data
             data['url'] = url
+            METRICS.record_fields(data)
             
-            property_data_cache = pd.concat([property_data_cache, pd.DataFrame([data])], ignore_index=True)
-            # save the cache to the file
-            save_to_parquet(property_data_cache, cache_file)
+            record_log.append(data)
+            if len(record_log) >= compact_every:
+                record_log.compact(cache_file)
             logging.info(f"Data collected for {url}")
-            # sleep for between 5 and 10 seconds
-            time.sleep(5 + 5 * random.random())
+        except CircuitOpenError as e:
+            logging.error(f"Stopping early: {e}")
+            break
         except Exception as e:
             logging.error(f"Error collecting data for {url}: {e}")
 
-    # Step 2: Convert the list of dictionaries into a DataFrame
-    df_properties = pd.DataFrame(property_data_cache)
+    # save the rest of the log to the cache file
+    record_log.compact(cache_file)
+    logging.info(cache.summary())
+    METRICS.write(shard_path(f'output/metrics_{date}.json', args.shard, args.num_shards),
+                  shard_path(f'output/metrics_{date}.prom', args.shard, args.num_shards))
+
+    # Step 2: Load the scraped properties into a DataFrame
+    df_properties = load_parquet(cache_file)
 
     # Step 3: Save the DataFrame to a Parquet file with the date
-    save_to_parquet(df_properties, f'output/hemnet_properties_{date}_final.parquet')
+    save_to_parquet(df_properties, shard_path(f'output/hemnet_properties_{date}_final.parquet', args.shard, args.num_shards))
     # Write a message to the log
     logging.info(f"Data saved to output/hemnet_properties_{date}.parquet")
 
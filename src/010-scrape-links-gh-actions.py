@@ -1,50 +1,88 @@
-from requests_html import HTMLSession
 # from folder called utils and file called scraper-utils.py import the functions get_data and parse_html
-from utils.scraper import collect_property_links_gh_actions
-from utils.storage import save_to_parquet, load_parquet
+from utils.crawler import collect_property_links_gh_actions_async, collect_new_property_links
+from utils.storage import save_to_parquet, append_to_parquet
+from utils.listing_index import ListingIndex, listing_ids, add_listing_id_column
+from utils.http_cache import HttpCache
+from utils.metrics import METRICS
+from utils.sharding import parse_shard_arguments, shard_of, shard_path, location_url
 import pandas as pd
 import os
 import logging
 
 # this script reads in a list of links already collected and then collects new links
-# the new links are then joined with the old links and duplicates are removed
-# the final list of links is then saved to a parquet file
+# the links that aren't in the listing id index yet are appended to the parquet file.
+# With --num-shards N the locations are split over N workers, each writing only its new links to
+# its own shard file; src/014-merge-shards.py merges them into hemnet_links.parquet
 def main():
+    args = parse_shard_arguments("Collect new property links for one or more hemnet locations.")
     # Step 1: Collect the links to the properties
-    # create a new HTML session
-    session = HTMLSession()
     # initiate logging
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
     # set the params
-    base_url = "https://www.hemnet.se/salda/bostader?location_ids%5B%5D=17989"
+    # the locations this worker is responsible for
+    locations = [location_id for location_id in args.locations if shard_of(location_id, args.num_shards) == args.shard]
+    logging.info(f"Shard {args.shard} of {args.num_shards}: locations {locations}")
+    # fetch up to this many search pages at once, and at most this many requests per second
+    concurrency = 4
+    qps = 1.0
+    # in incremental mode, stop paging once this many pages in a row hold only links we already have,
+    # instead of always fetching a fixed 10 pages
+    incremental = True
+    stop_after = 1
 
     # Get the date 
     date = pd.Timestamp.now().strftime("%Y-%m-%d")
 
     # existing property links fils
     property_links_file = f"data/interim/hemnet_links.parquet"
+    # every link is keyed on its int64 listing id, and the ids of all known links are kept in a
+    # sorted index with a bloom filter in front, so checking new links never loads the url strings
+    index_file = "data/interim/hemnet_links.ids.npy"
+    add_listing_id_column(property_links_file)
+    index = ListingIndex.load_or_build(index_file, property_links_file)
 
-    property_links = load_parquet(property_links_file)
+    # search pages are revalidated with conditional requests, so unchanged pages aren't downloaded again
+    cache = HttpCache()
     
-    new_property_links = collect_property_links_gh_actions(base_url)
-    df_new_links = pd.DataFrame(new_property_links, columns=['url'])
+    new_property_links = []
+    for location_id in locations:
+        base_url = location_url(location_id)
+        if incremental and len(index):
+            new_property_links += collect_new_property_links(base_url, index, stop_after=stop_after, qps=qps, cache=cache)
+        else:
+            new_property_links += collect_property_links_gh_actions_async(base_url, concurrency=concurrency, qps=qps, cache=cache)
+    logging.info(cache.summary())
+    METRICS.inc('links_total', len(new_property_links))
+    METRICS.write(shard_path('data/metrics/010-scrape-links.json', args.shard, args.num_shards),
+                  shard_path('data/metrics/010-scrape-links.prom', args.shard, args.num_shards))
 
-    # count how many new links were collected that were not in the original list by doing a set difference
-    new_links = set(new_property_links) - set(property_links['url'])
+    # keep each listing once, and only the ones the index doesn't know yet
+    df_new_links = pd.DataFrame({'url': new_property_links, 'listing_id': listing_ids(new_property_links)})
+    df_new_links = df_new_links.drop_duplicates('listing_id')
+    df_new_links = df_new_links[~index.contains(df_new_links['listing_id'].to_numpy())]
 
     # log the number of new links collected
-    if len(new_links) > 0:
-        logging.info(f"Collected {len(new_links)} new property links.")
+    if len(df_new_links) > 0:
+        logging.info(f"Collected {len(df_new_links)} new property links.")
     else:
         logging.info(f"No new property links collected.")
 
-    # join the new links with the old links and remove duplicates
-    df_links = pd.concat([property_links, df_new_links], ignore_index=True).drop_duplicates()
-        
-    save_to_parquet(df_links, property_links_file)
+    if args.num_shards > 1:
+        # only this shard's new links; the merge step adds them to the shared file
+        output_file = shard_path(property_links_file, args.shard, args.num_shards)
+        save_to_parquet(df_new_links, output_file)
+        logging.info(f"Saved {len(df_new_links)} new links to {output_file}")
+        return
 
-    print(f"There are a total of {len(df_links)} property links.")
+    # append the new links to the old ones, then add them to the index. If the run stops in between,
+    # the index no longer matches the links file and is rebuilt on the next run
+    if not df_new_links.empty:
+        append_to_parquet(df_new_links, property_links_file)
+        index.add(df_new_links['listing_id'].to_numpy())
+        index.save()
+
+    print(f"There are a total of {len(index)} property links.")
     
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,86 @@
+import argparse
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from utils.archive import HtmlArchive
+from utils.fast_parser import parse_html_fast
+from utils.scraper import extract_coordinates_from_html
+from utils.dataset import PartitionedDataset, PROPERTIES_DATASET
+from utils.manifest import Manifest, MANIFEST
+import pandas as pd
+
+# this script rebuilds the property dataset from the raw HTML archive written by 011, without making
+# a single request. Run it after changing parse_html (e.g. when hemnet renames a CSS class) and
+# every archived listing is parsed again across all cores.
+
+# columns that may have come from a browser session rather than the listing HTML, and are carried
+# over from the old dataset wherever the archived page doesn't have them
+CARRIED_COLUMNS = ['Latitude', 'Longitude']
+
+
+def parse_archived(args):
+    # a missing, corrupt or unparseable page is logged and skipped rather than ending the rebuild
+    archive_root, url, digest = args
+    try:
+        html_content = HtmlArchive(archive_root).get(digest)
+        data = parse_html_fast(html_content)
+        coordinates = extract_coordinates_from_html(html_content, url)
+    except Exception as e:
+        logging.error(f"Could not re-parse the archived page of {url} ({digest}): {e}")
+        return None
+    data['url'] = url
+    if coordinates:
+        data['Latitude'], data['Longitude'] = coordinates
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the property dataset from the raw HTML archive.")
+    parser.add_argument('--archive', default='data/html/archive')
+    parser.add_argument('--dataset', default=PROPERTIES_DATASET)
+    parser.add_argument('--manifest', default=MANIFEST)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    latest = HtmlArchive(args.archive).latest()
+    logging.info(f"Re-parsing {len(latest)} archived listings with {args.workers} workers.")
+
+    start = time.perf_counter()
+    jobs = [(args.archive, url, digest) for url, digest in zip(latest['url'], latest['sha256'])]
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        records = list(executor.map(parse_archived, jobs, chunksize=64))
+    elapsed = time.perf_counter() - start
+    failed = sum(record is None for record in records)
+    # listings whose page failed keep their rows from the old dataset, like listings that were never archived
+    records = [record for record in records if record is not None]
+    logging.info(f"Parsed {len(records)} listings in {elapsed:.1f}s ({len(jobs) / max(elapsed, 1e-9):.0f} pages/s); {failed} failed.")
+
+    df_reparsed = pd.DataFrame(records) if records else pd.DataFrame(columns=['url'])
+    dataset = PartitionedDataset(args.dataset)
+    property_data_cache = dataset.read()
+    if not property_data_cache.empty:
+        # keep the coordinates we already captured for these listings
+        carried = [c for c in CARRIED_COLUMNS if c in property_data_cache.columns]
+        if carried:
+            old = property_data_cache[['url'] + carried].drop_duplicates('url')
+            df_reparsed = df_reparsed.merge(old, on='url', how='left', suffixes=('', '_old'))
+            # columns the archived pages also had come back with an _old suffix and only fill the gaps
+            for column in carried:
+                if column + '_old' in df_reparsed.columns:
+                    df_reparsed[column] = df_reparsed[column].fillna(df_reparsed.pop(column + '_old'))
+        # listings scraped before the archive existed can't be re-parsed, so they are kept as they are
+        not_archived = property_data_cache[~property_data_cache['url'].isin(df_reparsed['url'])]
+        df_reparsed = pd.concat([not_archived, df_reparsed], ignore_index=True)
+
+    # every listing may have moved partition, so the dataset is rewritten as a whole
+    dataset.replace(df_reparsed)
+    # every downstream stage has to start over from the rebuilt dataset
+    Manifest(args.manifest).record(dataset.files(), run_id='rebuilt', kind='rebuild')
+    logging.info(f"Saved {len(df_reparsed)} listings to {args.dataset}.")
+
+
+if __name__ == "__main__":
+    main()
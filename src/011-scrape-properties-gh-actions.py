@@ -10,141 +10,206 @@ print(f"Utils path added to sys.path: {utils_path}")
 print(f"Current sys.path: {sys.path}")
 
 
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from requests_html import HTMLSession
-from utils.scraper import parse_html, extract_coordinates_from_request
-from utils.storage import save_to_parquet, load_parquet
+from utils.scraper import extract_coordinates_from_html
+from utils.fast_parser import parse_html_fast, FAST_PARSE_STATS
+from utils.storage import save_to_parquet, load_parquet, RecordLog
+from utils.dataset import PartitionedDataset, PROPERTIES_DATASET, LEGACY_CACHE
+from utils.manifest import Manifest
+from utils.frontier import Frontier
+from utils.listing_index import listing_ids
+from utils.metrics import METRICS
+from utils.sharding import parse_shard_arguments, shard_of, shard_path
+from utils.archive import HtmlArchive
+from utils.http_cache import HttpCache
+from utils.session import make_session, CircuitOpenError
+from utils.browser import setup_selenium_driver, extract_coordinates_from_selenium, BrowserPool
 import pandas as pd
+import requests
 import logging
-import time
-import random
-import json
-import re
-
-def setup_selenium_driver():
-    chrome_options = Options()
-    chrome_options.add_argument("--headless=new")  # <-- ADD THIS
-    chrome_options.add_argument("--disable-gpu")
-    chrome_options.add_argument("--window-size=1920x1080")
-    chrome_options.add_argument("--no-sandbox")  # <- Safe in CI
-    chrome_options.add_argument("--disable-dev-shm-usage")  # Prevents crashes on GitHub runners
-
-    chrome_options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
-
-    return webdriver.Chrome(options=chrome_options)
-
-
-def extract_coordinates_from_selenium(driver, url):
-    """Extract coordinates from Google Maps API requests using Selenium."""
-    try:
-        # Navigate to the URL
-        driver.get(url)
-        
-        # Wait for page and map to load
-        time.sleep(5)
-        
-        # Extract performance logs
-        logs = driver.get_log("performance")
-        
-        # Process logs to find the Maps API request
-        for entry in logs:
-            try:
-                log = json.loads(entry["message"])
-                if "message" not in log or "params" not in log["message"]:
-                    continue
-                    
-                params = log["message"]["params"]
-                
-                # Check for request will be sent
-                if log["message"]["method"] == "Network.requestWillBeSent":
-                    if "request" not in params:
-                        continue
-                        
-                    request = params["request"]
-                    request_url = request.get("url", "")
-                    if "SingleImageSearch" in request_url:
-                        if "postData" in request:
-                            # Look for coordinates in the post data
-                            post_data = request["postData"]
-                            coord_match = re.search(r'\[null,null,(\d+\.\d+),(\d+\.\d+)\]', post_data)
-                            if coord_match:
-                                lat = float(coord_match.group(1))
-                                lng = float(coord_match.group(2))
-                                return (lat, lng)
-                                
-            except Exception as e:
-                logging.error(f"Error processing log entry: {e}")
-    
-    except Exception as e:
-        logging.error(f"Error extracting coordinates: {e}")
-    
-    return None
 
 def main():
+    # with --num-shards N the listings are split over N workers by url; each one keeps its own
+    # frontier, and they all append to the same partitioned dataset
+    args = parse_shard_arguments("Scrape the listings in hemnet_links.parquet.")
+    shard, num_shards = args.shard, args.num_shards
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-    session = HTMLSession()
+    # every fetched page is kept so the cache can be rebuilt offline with 011-reparse-archive.py
+    archive = HtmlArchive('data/html/archive')
+    # listing pages fetched in an earlier, interrupted run are served from the HTTP cache, and the
+    # session paces the rest, backing off when hemnet answers with 429s or 5xx errors
+    session = make_session('listing', cache=HttpCache(archive=archive))
     
-    # Initialize Selenium driver for coordinate extraction
-    driver = setup_selenium_driver()
+    # Selenium is only started if a page comes without coordinates in its embedded page state
+    driver = None
+    # set this to load every listing in a pool of this many headless browsers instead, for when
+    # the coordinates can only be captured from the map request
+    browser_pool_size = 0
+    # where each listing's coordinates came from, so we can see how often the browser is still needed
+    coordinate_sources = {'html': 0, 'selenium': 0, 'missing': 0}
     
     # Get the date and time
     date_time = pd.Timestamp.now().strftime("%Y-%m-%d_%H-%M-%S")
 
     property_links_file = "data/interim/hemnet_links.parquet"
-    df_links = pd.read_parquet(property_links_file)
-
-    cache_file = 'data/interim/hemnet_properties_cache.parquet'
-    try:
-        property_data_cache = load_parquet(cache_file)
-    except FileNotFoundError:
-        property_data_cache = pd.DataFrame()
-
-    # Filter links not in the cache
-    if not property_data_cache.empty:
-        cached_urls = set(property_data_cache['url'])
-        df_links = df_links[~df_links['url'].isin(cached_urls)]
-
-    # Select a subset new properties
-    df_links_subset = df_links.head(1000)
-    logging.info(f"Selected {len(df_links_subset)} new properties for processing.")
-
-    for index, row in df_links_subset.iterrows():
-        url = row['url']
-        try:
-            # First get the HTML content with requests-html
-            r = session.get(url)
-            data = parse_html(r.html.html)
-            data['url'] = url
-            
-            # Then use Selenium to extract coordinates
-            coordinates = extract_coordinates_from_selenium(driver, url)
-            if coordinates:
-                data['Latitude'] = coordinates[0]
-                data['Longitude'] = coordinates[1]
-                logging.info(f"Successfully extracted coordinates for {url}: {coordinates}")
-            else:
-                logging.warning(f"Could not extract coordinates for {url}")
-
-            property_data_cache = pd.concat([property_data_cache, pd.DataFrame([data])], ignore_index=True)
-            logging.info(f"Data collected for {url}")
-            time.sleep(5 + 5 * random.random())  # Random delay between 5-10 seconds
-        except Exception as e:
-            logging.error(f"Error collecting data for {url}: {e}")
+    # the scraped listings, partitioned by sale year and month. A run only writes new files for the
+    # listings it adds, tagged with the run, so no run rewrites what earlier runs wrote and shards
+    # never write to the same file; src/016-compact-properties.py merges the small files
+    dataset = PartitionedDataset(PROPERTIES_DATASET)
+    # every run records the files it added in the snapshot manifest, which the downstream stages
+    # use to process only what is new since their last run
+    manifest = Manifest()
+    if not dataset.files() and os.path.exists(LEGACY_CACHE):
+        logging.info(f"Imported {dataset.import_files([LEGACY_CACHE])} listings from {LEGACY_CACHE}.")
+        manifest.record(dataset.files('imported'), run_id='imported')
+    run_id = date_time if num_shards <= 1 else f"{date_time}-shard-{shard}-of-{num_shards}"
+
+    def in_shard(urls):
+        # listings are assigned to shards by their listing id, so every spelling of a url lands in the same shard
+        urls = list(urls)
+        return [url for url, id_ in zip(urls, listing_ids(urls)) if shard_of(id_, num_shards) == shard]
+
+    # every listing url has a row in the frontier with its state, attempts and last error. Urls
+    # that keep failing are retried with backoff and eventually given up on, instead of coming
+    # back every week
+    frontier = Frontier(shard_path('data/interim/frontier.sqlite', shard, num_shards))
+    if len(frontier) == 0 and dataset.files():
+        # first run with a frontier: everything already in the dataset is done
+        frontier.add(in_shard(dataset.read(columns=['url'])['url']), state='done')
+    added = frontier.add(in_shard(load_parquet(property_links_file, columns=['url'])['url']))
+    logging.info(f"Added {added} new links to the frontier.")
+
+    # parsed listings are appended to this log as they come in, and moved into the dataset in
+    # batches, so an interrupted run loses at most one batch. A listing only counts as done in
+    # the frontier once its batch is on disk; the rest of an interrupted run is leased again later
+    record_log = RecordLog(shard_path('data/interim/hemnet_properties_cache.log.jsonl', shard, num_shards), batch_size=25,
+                           on_flush=lambda batch: frontier.done([record['url'] for record in batch]))
+    compact_every = 250
+    if len(record_log):
+        logging.info(f"Resuming: {len(record_log)} listings from an interrupted run are still in the log.")
+        frontier.done(record_log.urls())
+
+    # scrape at most this many listings per run, leasing them from the frontier a batch at a time
+    max_listings = 1000
+    # (the browser pool starts its browsers once per batch, so it gets everything in one batch)
+    lease_size = max_listings if browser_pool_size else 50
+    logging.info(f"Frontier: {frontier.counts()}")
+
+    # the fast parser is checked against parse_html on one page in this many; checking every page
+    # would parse each one twice (bench-parse-html.py checks a whole corpus offline)
+    verify_every = 20
+
+    def compact():
+        # the files are recorded as soon as they are written: files of a run that crashes later
+        # would otherwise never be in a snapshot, and the stages after this one would never see them
+        new_files = record_log.compact(dataset, run_id=run_id)
+        if new_files:
+            snapshot = manifest.record(new_files, run_id=run_id)
+            logging.info(f"Recorded snapshot {snapshot} with {len(new_files)} files in the manifest.")
+
+    def add_listing(url, html_content, coordinates):
+        with METRICS.timer('archive'):
+            archive.put(url, html_content)
+        with METRICS.timer('parse'):
+            data = parse_html_fast(html_content, verify=sum(FAST_PARSE_STATS.values()) % verify_every == 0)
+        data['url'] = url
+        if coordinates:
+            data['Latitude'] = coordinates[0]
+            data['Longitude'] = coordinates[1]
+            logging.info(f"Successfully extracted coordinates for {url}: {coordinates}")
+        else:
+            logging.warning(f"Could not extract coordinates for {url}")
+        METRICS.record_fields(data)
+        METRICS.inc('listings_total', outcome='done')
+        record_log.append(data)
+        if len(record_log) >= compact_every:
+            compact()
+        logging.info(f"Data collected for {url}")
+
+    def fail_listing(url, error):
+        # a listing that is gone won't come back, anything else is retried on a later run
+        permanent = isinstance(error, requests.HTTPError) and error.response is not None and error.response.status_code in (404, 410)
+        state = frontier.fail(url, error, permanent=permanent)
+        METRICS.inc('listings_total', outcome='failed')
+        logging.error(f"Error collecting data for {url} ({state}): {error}")
+
+    processed = 0
+    stopped = False
+    while processed < max_listings and not stopped:
+        batch = frontier.lease(min(lease_size, max_listings - processed))
+        if not batch:
+            break
+        processed += len(batch)
+
+        if browser_pool_size:
+            # every listing is loaded once in one of the pooled browsers, which gives both the HTML
+            # and the map request with the coordinates
+            for url, html_content, coordinates in BrowserPool(size=browser_pool_size).map(batch):
+                if html_content is None:
+                    frontier.fail(url, "page failed to load in the browser")
+                    METRICS.inc('listings_total', outcome='failed')
+                    continue
+                try:
+                    if coordinates:
+                        coordinate_sources['selenium'] += 1
+                    else:
+                        coordinates = extract_coordinates_from_html(html_content, url)
+                        coordinate_sources['html' if coordinates else 'missing'] += 1
+                    add_listing(url, html_content, coordinates)
+                except Exception as e:
+                    fail_listing(url, e)
+        else:
+            for i, url in enumerate(batch):
+                try:
+                    # First get the HTML content with requests-html
+                    r = session.get(url)
+                    r.raise_for_status()
+
+                    # Then read the coordinates from the same HTML, falling back to Selenium if they aren't there
+                    coordinates = extract_coordinates_from_html(r.html.html, url)
+                    if coordinates:
+                        coordinate_sources['html'] += 1
+                    else:
+                        if driver is None:
+                            driver = setup_selenium_driver()
+                        # the browser loads the listing again, so it takes a turn at the same pace
+                        session.controller.wait()
+                        with METRICS.timer('selenium'):
+                            coordinates = extract_coordinates_from_selenium(driver, url)
+                        coordinate_sources['selenium' if coordinates else 'missing'] += 1
+
+                    add_listing(url, r.html.html, coordinates)
+                except CircuitOpenError as e:
+                    # hemnet keeps refusing us; keep what we have, and hand the rest of the batch back
+                    logging.error(f"Stopping early: {e}")
+                    frontier.release(batch[i:])
+                    stopped = True
+                    break
+                except Exception as e:
+                    fail_listing(url, e)
 
     # Clean up the Selenium driver
-    driver.quit()
-
-    # Save updated cache and new data
-    save_to_parquet(property_data_cache, cache_file)
-    logging.info("Cache updated with new properties.")
-
-    if not property_data_cache.empty:
-        # Save only the newly added properties
-        new_properties = property_data_cache.tail(len(df_links_subset))
-        output_file = f'data/raw/hemnet_properties_{date_time}.parquet'
+    if driver is not None:
+        driver.quit()
+    logging.info(f"Coordinate sources: {coordinate_sources}")
+    logging.info(session.cache.summary())
+    logging.info(f"Fast parser stats: {FAST_PARSE_STATS}")
+
+    # Move what is left in the log into the dataset
+    compact()
+    logging.info("Dataset updated with new properties.")
+    logging.info(f"Frontier: {frontier.counts()}")
+
+    # Save only the newly added properties, which are the files this run wrote
+    new_properties = dataset.read(run_id=run_id)
+    if not new_properties.empty:
+        output_file = shard_path(f'data/raw/hemnet_properties_{date_time}.parquet', shard, num_shards)
         save_to_parquet(new_properties, output_file)
         logging.info(f"New property data saved to {output_file}")
 
+    # where the run's time went, and how often each field was found
+    METRICS.write(shard_path('data/metrics/011-scrape-properties.json', shard, num_shards),
+                  shard_path('data/metrics/011-scrape-properties.prom', shard, num_shards))
+    logging.info(f"Metrics: {METRICS.summary()['field_hit_rates']}")
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,19 +1,38 @@
 import pandas as pd
 import re
 
-def clean_and_transform_hemnet_data(input_file_path, output_file_path):
+from utils.dataset import RAW_COLUMNS
+from utils.manifest import Manifest
+from utils.storage import save_to_parquet, load_parquet, parquet_columns, row_hashes, upsert_parquet
+from utils.values import parse_columns, parse_numbers
+
+# bump this whenever a change below changes the cleaned values, so the next run cleans every listing
+# again instead of only the new ones
+CLEAN_VERSION = 1
+
+
+def clean_and_transform_hemnet_data(input_file_path, output_file_path, full=False):
     # Load the dataset
-    data = pd.read_parquet(input_file_path)
+    data = load_parquet(input_file_path)
 
-    # Numeric Conversion
-    def clean_numeric(column):
-        return pd.to_numeric(column.str.replace(' kr/m²', '').str.replace(' kr', '').str.replace(' ', '').str.replace('+', '').str.extract('(\d+)')[0], errors='coerce')
+    # Only listings that aren't in the output yet, or whose scraped values changed since they were
+    # cleaned, are cleaned and added to it; `full`, or a new CLEAN_VERSION, cleans everything. So
+    # does an output without the hashes, e.g. one cleaned before they were kept. The version is
+    # kept per output, since the same listings can be cleaned into more than one file
+    manifest = Manifest()
+    stage = f'clean:{output_file_path}'
+    full = full or manifest.version(stage) != CLEAN_VERSION or 'raw_hash' not in parquet_columns(output_file_path)
+    data = data.drop_duplicates('url', keep='last')
+    data['raw_hash'] = row_hashes(data, RAW_COLUMNS)
+    if not full:
+        done = load_parquet(output_file_path, columns=['url', 'raw_hash'])
+        data = data[~pd.MultiIndex.from_frame(data[['url', 'raw_hash']]).isin(pd.MultiIndex.from_frame(done))]
+        if data.empty:
+            return load_parquet(output_file_path)
 
-    data['Slutpris'] = clean_numeric(data['Slutpris'])
-    data['Utgångspris'] = clean_numeric(data['Utgångspris'])
-    data['Pris per kvadratmeter'] = clean_numeric(data['Pris per kvadratmeter'])
-    data['Avgift'] = clean_numeric(data['Avgift'])
-    data['Driftskostnad'] = clean_numeric(data['Driftskostnad'])
+    # Numeric Conversion
+    parse_columns(data, {'Slutpris': 'amount', 'Utgångspris': 'amount', 'Pris per kvadratmeter': 'amount',
+                         'Avgift': 'amount', 'Driftskostnad': 'amount'})
 
     # Date Handling
     swedish_to_english_months = {
@@ -54,16 +73,10 @@ def clean_and_transform_hemnet_data(input_file_path, output_file_path):
     data['Floor Number'] = data['Våning'].str.extract('(\d+)').astype(float)
     data['Elevator Presence'] = data['Våning'].apply(elevator_presence)
     
-    # Correctly extract numerical area values by defining a function for numeric conversion as above
-    def clean_numeric_area(column, unit):
-        if unit == 'm²':
-            return pd.to_numeric(column.str.replace(' m²', '').str.replace(',', '.'), errors='coerce')
-        elif unit == 'kr/år':
-            return pd.to_numeric(column.str.replace(' kr/år', '').str.replace(' ', ''), errors='coerce')
-
-    data['Biarea (m²)'] = clean_numeric_area(data['Biarea'], 'm²')
-    data['Tomtarea (m²)'] = clean_numeric_area(data['Tomtarea'], 'm²')
-    data['Arrende (kr/år)'] = clean_numeric_area(data['Arrende'], 'kr/år')
+    # Extract numerical area values, with their decimal commas, and the yearly leasehold fee
+    data['Biarea (m²)'] = parse_numbers(data['Biarea'], 'decimal')
+    data['Tomtarea (m²)'] = parse_numbers(data['Tomtarea'], 'decimal')
+    data['Arrende (kr/år)'] = parse_numbers(data['Arrende'], 'amount')
 
     # Translation of column names to English and conversion to snake case
     column_name_translation = {
@@ -106,6 +119,10 @@ def clean_and_transform_hemnet_data(input_file_path, output_file_path):
     data = data.rename(columns=column_name_translation)
 
     # Save the cleaned data to a new csv file
-    data.to_parquet(output_file_path, index=False)
+    if full:
+        save_to_parquet(data, output_file_path)
+    else:
+        upsert_parquet(data, output_file_path, key='url')
+    manifest.set_watermark(stage, manifest.latest(), version=CLEAN_VERSION)
 
-    return data
+    return data if full else load_parquet(output_file_path)
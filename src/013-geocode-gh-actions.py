@@ -1,13 +1,18 @@
-def geocode_addresses(data_file='data/interim/hemnet_properties_cache.parquet', cache_file='data/geodata/address_cache.parquet', user_agent="your_unique_user_agent_here"):
+def geocode_addresses(data_file='data/interim/properties', cache_file='data/geodata/address_cache.parquet', user_agent="your_unique_user_agent_here"):
     from geopy.geocoders import Nominatim
     from geopy.extra.rate_limiter import RateLimiter
     from geopy.exc import GeocoderTimedOut, GeocoderQuotaExceeded
     import pandas as pd
     import json
     import re
+    from utils.storage import save_to_parquet, load_parquet
+    from utils.manifest import Manifest
 
-    # Load your data
-    data = pd.read_parquet(data_file)
+    # Load your data: only the listings added since the last run that got through all its
+    # addresses, as recorded in the snapshot manifest (everything on the first run)
+    manifest = Manifest()
+    data, snapshot_id, full = manifest.changes('geocode', columns=['Title'], root=data_file)
+    print(f"Geocoding {'all' if full else 'new'} listings: {len(data)} rows.")
 
     addresses = data["Title"].unique()
 
@@ -15,11 +20,11 @@ def geocode_addresses(data_file='data/interim/hemnet_properties_cache.parquet',
 
     # Try to load existing cache
     try:
-        cache_df = pd.read_parquet(cache_file)
-        # Ensure the dataframe is not empty
-        if not cache_df.empty:
-            # Convert the dataframe to a dictionary with titles as keys and lat-long tuples as values
-            cache = dict(zip(cache_df.Title, zip(cache_df.Lat, cache_df.Long)))
+        cache_df = load_parquet(cache_file, columns=['Title', 'Lat', 'Long'])
+        # Convert the dataframe to a dictionary with titles as keys and lat-long tuples as values
+        cache = dict(zip(cache_df.Title, zip(cache_df.Lat, cache_df.Long)))
+        if cache_df.empty:
+            raise FileNotFoundError(cache_file)
     except FileNotFoundError:
         print("Cache file not found. Starting with an empty cache.")
         cache = {}
@@ -27,7 +32,8 @@ def geocode_addresses(data_file='data/interim/hemnet_properties_cache.parquet',
     # Find addresses that are not in the cache
     df_addresses = df_addresses[~df_addresses['title'].isin(cache.keys())]
 
-    # Take the first 1000 addresses for processing
+    # Take the first 1000 addresses for processing; the rest wait for the next run
+    caught_up = len(df_addresses) <= 1000
     df_addresses = df_addresses.head(1000)
 
     # Initialize the geocoder with a unique user_agent
@@ -60,7 +66,9 @@ def geocode_addresses(data_file='data/interim/hemnet_properties_cache.parquet',
     cache_df = pd.DataFrame(list(cache.items()), columns=['Title', 'LatLon'])
     cache_df[['Lat', 'Long']] = pd.DataFrame(cache_df['LatLon'].tolist(), index=cache_df.index)
     cache_df.drop(columns=['LatLon'], inplace=True)
-    cache_df.to_parquet(cache_file)
+    save_to_parquet(cache_df, cache_file)
+    if caught_up:
+        manifest.set_watermark('geocode', snapshot_id)
 
 
 # Run the function
@@ -0,0 +1,51 @@
+import argparse
+import logging
+import os
+import subprocess
+import sys
+import time
+
+from utils.sharding import merge_shards, shard_files
+
+# this script merges the per-shard outputs written by sharded runs of 01-scrape.py and 010
+# (files named <name>.shard-<k>-of-<n>.parquet) into the shared, deduplicated files.
+# With --run it first starts --num-shards local worker processes of a scraper and waits for them,
+# so e.g. `python src/014-merge-shards.py --run src/011-scrape-properties-gh-actions.py --num-shards 4`
+# scrapes with four workers and merges the result. (011 shards append straight to the partitioned
+# property dataset, so there is nothing of theirs to merge.) On several machines, run the scraper with
+# --shard/--num-shards (or SHARD_INDEX/SHARD_COUNT) on each, collect the shard files and run this
+# script without --run.
+
+DEFAULT_PATHS = ['data/interim/hemnet_links.parquet']
+
+
+def run_workers(script, num_shards, extra_args):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [os.getcwd(), os.environ.get('PYTHONPATH')])))
+    start = time.perf_counter()
+    workers = [subprocess.Popen([sys.executable, script, '--shard', str(shard), '--num-shards', str(num_shards)] + extra_args, env=env)
+               for shard in range(num_shards)]
+    codes = [worker.wait() for worker in workers]
+    logging.info(f"{num_shards} workers of {script} finished in {time.perf_counter() - start:.1f}s with exit codes {codes}")
+    return codes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge per-shard scraper outputs into the shared files.")
+    parser.add_argument('paths', nargs='*', default=DEFAULT_PATHS, help="merged files to build from their shard files")
+    parser.add_argument('--run', metavar='SCRIPT', help="start --num-shards workers of this scraper first")
+    parser.add_argument('--num-shards', type=int, default=2)
+    parser.add_argument('--keep', action='store_true', help="keep the shard files after merging")
+    args, extra_args = parser.parse_known_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if args.run and any(run_workers(args.run, args.num_shards, extra_args)):
+        logging.error("Some workers failed; merging what they wrote anyway.")
+
+    for path in args.paths:
+        files = shard_files(path)
+        added = merge_shards(path, remove=not args.keep)
+        logging.info(f"Merged {len(files)} shard files into {path}: {added} new rows.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import argparse
+import glob
+import logging
+import time
+
+import pandas as pd
+
+from utils.dataset import PartitionedDataset, PROPERTIES_DATASET, LEGACY_CACHE
+from utils.manifest import Manifest, MANIFEST
+
+# the scraped listings live in a dataset partitioned by sale year and month
+# (data/interim/properties/sale_year=YYYY/sale_month=M/part-*.parquet), which every 011 run and
+# shard appends new files to. This script keeps it tidy:
+#   compact  merges the files of each partition that has collected several, e.g. after a month of
+#            weekly runs; readers see the same table before and after
+#   import   moves the old single-file cache and the per-run files in data/raw into the dataset,
+#            skipping listings it already has
+# Both are recorded in the snapshot manifest, so downstream stages know where the rows went.
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact the partitioned property dataset, or import older files into it.")
+    parser.add_argument('command', choices=['compact', 'import'])
+    parser.add_argument('files', nargs='*', help="files to import (default: the old cache and data/raw)")
+    parser.add_argument('--dataset', default=PROPERTIES_DATASET)
+    parser.add_argument('--min-files', type=int, default=4, help="compact partitions with at least this many files")
+    parser.add_argument('--manifest', default=MANIFEST)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    dataset = PartitionedDataset(args.dataset)
+    manifest = Manifest(args.manifest)
+    start = time.perf_counter()
+    if args.command == 'compact':
+        before = len(dataset.files())
+        # each partition's snapshot is recorded as soon as it is merged, before its old files go
+        merged = dataset.compact(min_files=args.min_files,
+                                 on_merged=lambda path, replaced: manifest.record([path], run_id='compacted', kind='compact', replaces=replaced))
+        after = before - sum(len(replaced) - 1 for _, replaced in merged)
+        logging.info(f"Compacted {before} files into {after} in {time.perf_counter() - start:.1f}s.")
+    else:
+        files = args.files or [LEGACY_CACHE] + sorted(glob.glob('data/raw/hemnet_properties_*.parquet'))
+        run_id = 'imported-' + pd.Timestamp.now(tz='UTC').strftime('%Y%m%dT%H%M%S')
+        added = dataset.import_files(files, run_id=run_id)
+        manifest.record(dataset.files(run_id), run_id=run_id)
+        logging.info(f"Imported {added} listings from {len(files)} files in {time.perf_counter() - start:.1f}s; the dataset has {len(dataset)}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 import pandas as pd
 import re
 
+from utils.values import parse_numbers
+
 # Load the dataset
 file_path = 'temp/hemnet_properties_sample.csv'
 data = pd.read_csv(file_path)
@@ -12,7 +14,7 @@ data.head()
 # Step 1: Numeric Conversion
 # Define a function to clean numeric fields
 def clean_numeric(column):
-    return pd.to_numeric(column.str.replace(' kr/m²', '').str.replace(' kr', '').str.replace(' ', '').str.replace('+', '').str.extract('(\d+)')[0], errors='coerce')
+    return parse_numbers(column, 'amount')
 
 # Apply the function to the relevant columns
 data['Slutpris'] = clean_numeric(data['Slutpris'])
@@ -74,11 +76,11 @@ data['Floor Number'] = data['Våning'].str.extract('(\d+)').astype(float)  # Ext
 data['Elevator Presence'] = data['Våning'].apply(lambda x: 1 if 'hiss finns' in str(x) else 0)
 
 # Correctly extract numerical area values from 'Biarea' and 'Tomtarea' (including handling commas for decimal points)
-data['Biarea (m²)'] = data['Biarea'].str.replace(' m²', '').str.replace(',', '.').astype(float)
-data['Tomtarea (m²)'] = data['Tomtarea'].str.replace(' m²', '').str.replace(',', '.').astype(float)
+data['Biarea (m²)'] = parse_numbers(data['Biarea'], 'decimal')
+data['Tomtarea (m²)'] = parse_numbers(data['Tomtarea'], 'decimal')
 
 # Extract numerical value from 'Arrende' correctly handling space and kr/år
-data['Arrende (kr/år)'] = data['Arrende'].str.replace(' kr/år', '').str.replace(' ', '').astype(float)
+data['Arrende (kr/år)'] = parse_numbers(data['Arrende'], 'amount')
 
 
 # Translation of column names to English and conversion to snake case
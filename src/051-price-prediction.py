@@ -1,3 +1,5 @@
+import os
+import sys
 import pandas as pd
 import numpy as np
 from sklearn.ensemble import RandomForestRegressor
@@ -11,6 +13,12 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 from sklearn.inspection import permutation_importance
 
+# the app and the analysis run from src/, where the utils package isn't importable on its own
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from utils.query import top_and_bottom_neighborhoods
+from utils.values import map_unique
+
 # Load the dataset
 def load_and_preprocess_data(file_path):
     """Load and preprocess the Malmö housing dataset."""
@@ -21,7 +29,7 @@ def load_and_preprocess_data(file_path):
     df = df[df['final_price'] < 15000000]  # Cap at reasonable upper limit
     
     # Extract neighborhood from location
-    df['neighborhood'] = df['location'].apply(lambda x: x.split(',')[0].strip() if isinstance(x, str) else None)
+    df['neighborhood'] = map_unique(df['location'], lambda locations: locations.str.split(',').str[0].str.strip())
     
     # Clean up year_of_construction
     df['year_of_construction'] = df['year_of_construction'].apply(
@@ -136,15 +144,14 @@ def plot_feature_importance(importance_df):
     plt.savefig('feature_importance.png')
     plt.close()
 
-def analyze_top_neighborhoods(df):
-    """Analyze top and bottom neighborhoods by median price."""
-    neighborhood_stats = df.groupby('neighborhood')['final_price'].agg(['count', 'median'])
-    neighborhood_stats = neighborhood_stats[neighborhood_stats['count'] >= 100]  # Only consider neighborhoods with enough data
-    
-    top_neighborhoods = neighborhood_stats.sort_values('median', ascending=False).head(10)
-    bottom_neighborhoods = neighborhood_stats.sort_values('median').head(10)
-    
-    return top_neighborhoods, bottom_neighborhoods
+def analyze_top_neighborhoods(file_path):
+    """Analyze top and bottom neighborhoods by median price.
+
+    Runs as a lazy query over the data file (utils/query.py), with the same outlier filter and
+    neighborhood split as load_and_preprocess_data, so the data isn't loaded again for it.
+    """
+    # Only consider neighborhoods with enough data
+    return top_and_bottom_neighborhoods(file_path, n=10, min_count=100)
 
 def price_prediction_function(model, input_data):
     """Function for predicting prices based on input features."""
@@ -170,7 +177,7 @@ def main():
     plot_feature_importance(importance_df)
     
     # Analyze neighborhood data
-    top_neighborhoods, bottom_neighborhoods = analyze_top_neighborhoods(df)
+    top_neighborhoods, bottom_neighborhoods = analyze_top_neighborhoods('hemnet_properties.csv')
     
     return model, df, preprocessor, importance_df, top_neighborhoods, bottom_neighborhoods
 
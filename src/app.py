@@ -8,8 +8,15 @@ from folium.plugins import Draw
 import matplotlib.pyplot as plt
 import seaborn as sns
 import os
+import sys
 import joblib
-from malmo_housing_price_model import load_and_preprocess_data, prepare_features, build_model, get_feature_importance
+
+# the app and the analysis run from src/, where the utils package isn't importable on its own
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from malmo_housing_price_model import prepare_features, build_model, get_feature_importance
+from app_data import artifact_paths, load_app_data, read_meta, compute_data_ranges
+from utils.query import top_and_bottom_neighborhoods, yearly_price_stats
 
 # Set page configuration
 st.set_page_config(
@@ -18,13 +25,25 @@ st.set_page_config(
     initial_sidebar_state="expanded",
 )
 
-# Cache data loading to improve performance
-@st.cache_data
+DATA_FILE = 'hemnet_properties.csv'
+
+# Cache data loading to improve performance. The data is memory-mapped from the preprocessed
+# artifact, so it is cached as a resource: cache_data would pickle a copy of it for every session
+@st.cache_resource
 def load_data():
-    """Load and preprocess the dataset."""
-    df = load_and_preprocess_data('hemnet_properties.csv')
+    """Load the preprocessed dataset."""
+    df, _ = load_app_data(DATA_FILE)
     return df
 
+@st.cache_data
+def load_market_insights():
+    """Aggregate the neighborhood and yearly price statistics with lazy queries over the app data."""
+    # the memory-mapped artifact load_data() builds, rather than parsing the CSV again
+    load_data()
+    feather_path, _ = artifact_paths(DATA_FILE)
+    top_neighborhoods, bottom_neighborhoods = top_and_bottom_neighborhoods(feather_path, n=10, min_count=100)
+    return top_neighborhoods, bottom_neighborhoods, yearly_price_stats(feather_path)
+
 @st.cache_resource
 def load_or_train_model(df):
     """Load a saved model or train a new one if not available."""
@@ -48,61 +67,9 @@ def load_or_train_model(df):
 
 def get_data_ranges(df):
     """Extract min/max values and unique values for all features."""
-    data_ranges = {
-        'number_of_rooms': {
-            'min': df['number_of_rooms'].min(),
-            'max': df['number_of_rooms'].max(),
-            'type': 'numeric'
-        },
-        'living_area': {
-            'min': df['living_area'].min(),
-            'max': df['living_area'].max(),
-            'type': 'numeric'
-        },
-        'year_of_construction': {
-            'min': df[df['year_of_construction'] >= 1800]['year_of_construction'].min(),
-            'max': df['year_of_construction'].max(),
-            'type': 'numeric'
-        },
-        'fee': {
-            'min': df['fee'].min(),
-            'max': df['fee'].max(),
-            'type': 'numeric'
-        },
-        'floor_number': {
-            'min': df['floor_number'].min(),
-            'max': df['floor_number'].max(),
-            'type': 'numeric'
-        },
-        'top_floor_number': {
-            'min': df['top_floor_number'].min(),
-            'max': df['top_floor_number'].max(),
-            'type': 'numeric'
-        },
-        'elevator_presence': {
-            'options': [0, 1],
-            'type': 'categorical'
-        },
-        'ownership_form': {
-            'options': sorted(df['ownership_form'].unique()),
-            'type': 'categorical'
-        },
-        'neighborhood': {
-            'options': sorted(df['neighborhood'].unique()),
-            'type': 'categorical'
-        },
-        'latitude': {
-            'min': df['latitude'].min(),
-            'max': df['latitude'].max(),
-            'type': 'numeric'
-        },
-        'longitude': {
-            'min': df['longitude'].min(),
-            'max': df['longitude'].max(),
-            'type': 'numeric'
-        }
-    }
-    return data_ranges
+    # precomputed when the app data was built, see app_data.py
+    meta = read_meta(DATA_FILE)
+    return meta['ranges'] if meta is not None else compute_data_ranges(df)
 
 def predict_price(model, input_data, df, preprocessor):
     """Generate a price prediction based on user inputs."""
@@ -177,16 +144,8 @@ def plot_feature_importance(importance_df):
     ax.set_xlabel('Relative Importance')
     st.pyplot(fig)
 
-def plot_neighborhood_price_comparison(df):
+def plot_neighborhood_price_comparison(top_neighborhoods, bottom_neighborhoods):
     """Plot comparison of median prices by neighborhood."""
-    # Get neighborhood stats
-    neighborhood_stats = df.groupby('neighborhood')['final_price'].agg(['count', 'median'])
-    neighborhood_stats = neighborhood_stats[neighborhood_stats['count'] >= 100]  # Only neighborhoods with enough data
-    
-    # Get top and bottom 10 neighborhoods by price
-    top_neighborhoods = neighborhood_stats.sort_values('median', ascending=False).head(10)
-    bottom_neighborhoods = neighborhood_stats.sort_values('median').head(10)
-    
     # Create plots
     fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(16, 8))
     
@@ -203,11 +162,8 @@ def plot_neighborhood_price_comparison(df):
     fig.tight_layout()
     return fig
 
-def plot_price_trends(df):
+def plot_price_trends(yearly_prices):
     """Plot price trends over time."""
-    # Aggregate by year
-    yearly_prices = df.groupby('sale_year')['final_price'].agg(['median', 'mean', 'count']).reset_index()
-    
     fig, ax = plt.subplots(figsize=(10, 6))
     sns.lineplot(x='sale_year', y='median', data=yearly_prices, marker='o', label='Median Price', ax=ax)
     sns.lineplot(x='sale_year', y='mean', data=yearly_prices, marker='x', label='Mean Price', ax=ax)
@@ -413,12 +369,13 @@ def main():
         
         # Neighborhood comparison
         st.subheader("Neighborhood Price Comparison")
-        fig = plot_neighborhood_price_comparison(df)
+        top_neighborhoods, bottom_neighborhoods, yearly_prices = load_market_insights()
+        fig = plot_neighborhood_price_comparison(top_neighborhoods, bottom_neighborhoods)
         st.pyplot(fig)
         
         # Price trends
         st.subheader("Price Trends (2013-2024)")
-        trend_fig = plot_price_trends(df)
+        trend_fig = plot_price_trends(yearly_prices)
         st.pyplot(trend_fig)
         
         # Price distribution by property type
@@ -0,0 +1,136 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+
+# the app and the analysis run from src/, where the utils package isn't importable on its own
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from malmo_housing_price_model import load_and_preprocess_data
+
+# The app starts from a preprocessed copy of the data: an uncompressed Arrow IPC (Feather v2) file
+# that is memory-mapped instead of parsed, next to a small JSON sidecar with the value ranges and
+# options the input widgets need. Mapped pages come straight from the OS page cache, so a cold
+# start reads next to nothing and app replicas on one machine share the same memory.
+#
+#   python src/app_data.py hemnet_properties.csv
+#
+# rebuilds both; the app also rebuilds them itself when the CSV has changed since.
+
+# bumped when the layout of the artifact changes, so artifacts built before are rebuilt
+ARTIFACT_FORMAT = 2
+
+# repeated strings are stored once and come back as categoricals
+CATEGORICAL_COLUMNS = ['neighborhood', 'ownership_form', 'type', 'type_2', 'location', 'agent_name', 'housing_association', 'floor']
+
+
+def artifact_paths(csv_path):
+    root = os.path.splitext(csv_path)[0]
+    return root + '.feather', root + '.meta.json'
+
+
+def _value(x):
+    # numpy scalars and NaN as plain JSON values
+    if isinstance(x, (np.integer, np.floating)):
+        x = x.item()
+    return None if isinstance(x, float) and np.isnan(x) else x
+
+
+def compute_data_ranges(df):
+    """Extract min/max values and unique values for all features."""
+    def numeric(values):
+        return {'min': _value(values.min()), 'max': _value(values.max()), 'type': 'numeric'}
+
+    def options(column):
+        return {'options': sorted(str(v) for v in df[column].dropna().unique()), 'type': 'categorical'}
+
+    return {
+        'number_of_rooms': numeric(df['number_of_rooms']),
+        'living_area': numeric(df['living_area']),
+        'year_of_construction': {'min': _value(df.loc[df['year_of_construction'] >= 1800, 'year_of_construction'].min()),
+                                 'max': _value(df['year_of_construction'].max()), 'type': 'numeric'},
+        'fee': numeric(df['fee']),
+        'floor_number': numeric(df['floor_number']),
+        'top_floor_number': numeric(df['top_floor_number']),
+        'elevator_presence': {'options': [0, 1], 'type': 'categorical'},
+        'ownership_form': options('ownership_form'),
+        'neighborhood': options('neighborhood'),
+        'latitude': numeric(df['latitude']),
+        'longitude': numeric(df['longitude']),
+    }
+
+
+def _source_stamp(csv_path):
+    stat = os.stat(csv_path)
+    return {'source': os.path.abspath(csv_path), 'source_size': stat.st_size, 'source_mtime': stat.st_mtime}
+
+
+def build_app_data(csv_path):
+    """Preprocess the CSV once and write the Feather file and its sidecar; return the sidecar."""
+    df = load_and_preprocess_data(csv_path).reset_index(drop=True)
+    for column in CATEGORICAL_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype('category')
+    feather_path, meta_path = artifact_paths(csv_path)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    for i, field in enumerate(table.schema):
+        if pa.types.is_dictionary(field.type):
+            # pandas stores a missing category as index -1, which polars (utils/query.py) refuses
+            # to read; encoding the strings again gives those slots a valid index
+            table = table.set_column(i, field.name, pc.dictionary_encode(table.column(i).cast(pa.string())))
+    # uncompressed, because compressed buffers can't be memory-mapped
+    feather.write_feather(table, feather_path + '.tmp', compression='uncompressed')
+    meta = dict(_source_stamp(csv_path), format=ARTIFACT_FORMAT, rows=len(df), built_at=pd.Timestamp.now(tz='UTC').isoformat(), ranges=compute_data_ranges(df))
+    with open(meta_path + '.tmp', 'w') as f:
+        json.dump(meta, f, indent=2, ensure_ascii=False)
+    os.replace(feather_path + '.tmp', feather_path)
+    os.replace(meta_path + '.tmp', meta_path)
+    return meta
+
+
+def read_meta(csv_path):
+    """Return the sidecar of the CSV's artifact, or None if there is none, it has an older format, or the CSV changed since it was built."""
+    feather_path, meta_path = artifact_paths(csv_path)
+    if not (os.path.exists(feather_path) and os.path.exists(meta_path)):
+        return None
+    with open(meta_path) as f:
+        meta = json.load(f)
+    if meta.get('format') != ARTIFACT_FORMAT:
+        return None
+    if os.path.exists(csv_path):
+        stamp = _source_stamp(csv_path)
+        if (meta.get('source_size'), meta.get('source_mtime')) != (stamp['source_size'], stamp['source_mtime']):
+            return None
+    return meta
+
+
+def load_app_data(csv_path):
+    """Return (df, data ranges) from the memory-mapped artifact, building it first if it is missing or stale."""
+    meta = read_meta(csv_path)
+    if meta is None:
+        meta = build_app_data(csv_path)
+    feather_path, _ = artifact_paths(csv_path)
+    # numeric columns without nulls point straight into the mapped file; split_blocks keeps pandas
+    # from consolidating (and so copying) them into 2D blocks
+    table = feather.read_table(feather_path, memory_map=True)
+    return table.to_pandas(split_blocks=True), meta['ranges']
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the memory-mapped data file the app starts from.")
+    parser.add_argument('csv', nargs='?', default='hemnet_properties.csv')
+    args = parser.parse_args()
+    start = time.perf_counter()
+    meta = build_app_data(args.csv)
+    print(f"Wrote {artifact_paths(args.csv)[0]} ({meta['rows']} rows) in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import argparse
+import glob
+import os
+import random
+import sys
+import time
+
+from requests_html import HTMLSession
+from utils.scraper import parse_html
+from utils.fast_parser import _parse_html_fast
+from utils.storage import load_parquet
+
+# this script checks that the fast lxml parser gives exactly the same output as parse_html over a
+# corpus of saved listing pages, and measures how many pages per second each of them parses.
+# `record` saves a random sample of listing pages from hemnet_links.parquet into the corpus first.
+
+
+def record(corpus_dir, n):
+    os.makedirs(corpus_dir, exist_ok=True)
+    session = HTMLSession()
+    df_links = load_parquet("data/interim/hemnet_links.parquet", columns=['url'])
+    for url in df_links['url'].sample(n, random_state=42):
+        # the listing id at the end of the url makes a stable file name
+        path = os.path.join(corpus_dir, url.rstrip('/').rsplit('-', 1)[-1] + '.html')
+        if os.path.exists(path):
+            continue
+        try:
+            r = session.get(url)
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(r.html.html)
+            print(f"Saved {url} to {path}")
+        except Exception as e:
+            print(f"Error saving {url}: {e}")
+        time.sleep(5 + 5 * random.random())
+
+
+def load_corpus(corpus_dir):
+    pages = {}
+    for path in sorted(glob.glob(os.path.join(corpus_dir, '*.html'))):
+        with open(path, encoding='utf-8') as f:
+            pages[path] = f.read()
+    return pages
+
+
+def pages_per_second(parse, pages, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for html_content in pages:
+            parse(html_content)
+    return rounds * len(pages) / (time.perf_counter() - start)
+
+
+def benchmark(corpus_dir, rounds):
+    pages = load_corpus(corpus_dir)
+    if not pages:
+        print(f"No pages in {corpus_dir}, run `record` first.")
+        return 1
+
+    # equivalence: the fast parser has to match parse_html field for field on every page
+    mismatches = 0
+    for path, html_content in pages.items():
+        expected = parse_html(html_content)
+        try:
+            actual = _parse_html_fast(html_content)
+        except Exception as e:
+            actual = f"error: {e}"
+        if actual != expected:
+            mismatches += 1
+            print(f"MISMATCH {path}\n  parse_html: {expected}\n  fast:       {actual}")
+    print(f"{len(pages) - mismatches} of {len(pages)} pages parsed identically.")
+
+    slow = pages_per_second(parse_html, list(pages.values()), rounds)
+    fast = pages_per_second(_parse_html_fast, list(pages.values()), rounds)
+    print(f"parse_html:      {slow:8.1f} pages/s")
+    print(f"parse_html_fast: {fast:8.1f} pages/s ({fast / slow:.1f}x)")
+    return 1 if mismatches else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Equivalence test and benchmark for the fast listing parser.")
+    parser.add_argument('command', nargs='?', default='run', choices=['run', 'record'])
+    parser.add_argument('--corpus', default='data/html/listings', help="directory of saved listing pages")
+    parser.add_argument('--n', type=int, default=200, help="number of listing pages to record")
+    parser.add_argument('--rounds', type=int, default=3, help="times to parse the corpus when timing")
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        record(args.corpus, args.n)
+        return 0
+    return benchmark(args.corpus, args.rounds)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
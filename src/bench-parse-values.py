@@ -0,0 +1,87 @@
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils.dataset import load_properties
+from utils.values import parse_numbers
+
+# this script compares parse_numbers with the chains of str.replace the transform scripts used to
+# clean Swedish-formatted values with, on the scraped listings repeated --repeat times. It prints
+# how many values each of them parses differently and how long each takes per column.
+
+# column: (kind, the old cleaning of ExtendedCleanNumericTransformer)
+STANDARD, AREA, COST = 'standard', 'area', 'cost'
+COLUMNS = {
+    'Slutpris': ('amount', STANDARD),
+    'Utgångspris': ('amount', STANDARD),
+    'Pris per kvadratmeter': ('amount', STANDARD),
+    'Avgift': ('amount', STANDARD),
+    'Driftskostnad': ('amount', STANDARD),
+    'Byggår': ('year', STANDARD),
+    'Antal rum': ('decimal', STANDARD),
+    'Boarea': ('decimal', AREA),
+    'Biarea': ('decimal', AREA),
+    'Tomtarea': ('decimal', AREA),
+    'Arrende': ('amount', COST),
+}
+
+
+def old_clean(column, cleaning):
+    if cleaning == STANDARD:
+        return pd.to_numeric(column.astype(str).str.replace(' kr/m²', '')
+                             .str.replace(' kr', '')
+                             .str.replace(' rum', '')
+                             .str.replace(' ', '')
+                             .str.replace('+', '')
+                             .str.extract(r'(\d+)')[0], errors='coerce')
+    if cleaning == AREA:
+        return pd.to_numeric(column.astype(str).str.replace(' m²', '').str.replace(',', '.'), errors='coerce')
+    return pd.to_numeric(column.astype(str).str.replace(' kr/år', '').str.replace(' ', ''), errors='coerce')
+
+
+def timed(f, *args):
+    start = time.perf_counter()
+    result = f(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the vectorized value parser against the old cleaning code.")
+    parser.add_argument('--repeat', type=int, default=10, help="repeat the listings this many times")
+    args = parser.parse_args()
+
+    listings = load_properties(columns=list(COLUMNS))
+    if listings.empty:
+        print("No scraped listings to benchmark on.")
+        return 1
+    # plain strings, as the old code got them, and categoricals, as the dataset is read now
+    data = pd.concat([listings] * args.repeat, ignore_index=True)
+    strings = data.astype(object).where(data.notna(), None)
+    print(f"{len(data)} rows")
+    print(f"{'column':24} {'kind':8} {'old':>8} {'new':>8} {'new, cat':>9} {'differ':>7}")
+
+    total_old = total_new = total_categorical = 0
+    for column, (kind, cleaning) in COLUMNS.items():
+        if column not in data.columns:
+            continue
+        old, t_old = timed(old_clean, strings[column], cleaning)
+        new, t_new = timed(parse_numbers, strings[column], kind)
+        categorical, t_categorical = timed(parse_numbers, data[column].astype('category'), kind)
+        assert new.equals(categorical)
+        differ = int((~np.isclose(old, new, equal_nan=True)).sum())
+        total_old, total_new, total_categorical = total_old + t_old, total_new + t_new, total_categorical + t_categorical
+        print(f"{column:24} {kind:8} {t_old:7.2f}s {t_new:7.2f}s {t_categorical:8.2f}s {differ:7}")
+        if differ:
+            examples = strings.loc[~np.isclose(old, new, equal_nan=True), column].drop_duplicates().head(3)
+            for value in examples:
+                print(f"    {value!r}: old {old_clean(pd.Series([value]), cleaning)[0]}, new {parse_numbers(pd.Series([value]), kind)[0]}")
+    print(f"{'total':33} {total_old:7.2f}s {total_new:7.2f}s {total_categorical:8.2f}s")
+    print(f"{total_old / total_new:.1f}x faster on strings, {total_old / total_categorical:.1f}x on categoricals")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from utils.crawler import collect_property_links_adaptive, collect_property_links_async
+from utils.scraper import collect_property_links, extract_coordinates_from_html
+from utils.fast_parser import parse_html_fast
+from utils.session import make_session, CircuitOpenError
+from utils.metrics import METRICS
+from utils.standin import StandinServer
+import pandas as pd
+
+# this script runs the real link collectors and the 011 listing loop against a local stand-in for
+# hemnet.se (utils/standin.py) that replays recorded listing pages, so changes to concurrency,
+# pacing or retries can be measured offline and reproducibly. The stand-in can add latency,
+# 5xx errors and 429s, and reports what it served.
+
+
+def percentile(values, q):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def report(name, elapsed, pages, server):
+    latencies = server.stats['latencies']
+    return {
+        'run': name,
+        'seconds': round(elapsed, 2),
+        'pages': pages,
+        'pages/s': round(pages / elapsed, 1) if elapsed else None,
+        'requests': server.stats['requests'],
+        'p50 ms': round(1000 * percentile(latencies, 0.5), 1),
+        'p90 ms': round(1000 * percentile(latencies, 0.9), 1),
+        'p99 ms': round(1000 * percentile(latencies, 0.99), 1),
+        'statuses': dict(sorted(server.stats['statuses'].items())),
+        'MB': round(server.stats['bytes'] / 1e6, 2),
+    }
+
+
+def fast_session(kind, qps):
+    # the profiles are tuned for hemnet; against the stand-in we only want the ceiling we ask for
+    session = make_session(kind)
+    session.controller.qps = session.controller.max_qps = qps
+    session.controller.min_qps = qps / 20
+    session.breaker.cooldown = 1
+    return session
+
+
+def bench_links(server, args):
+    results = []
+    for concurrency in args.concurrency:
+        server.reset_stats()
+        METRICS.reset()
+        start = time.perf_counter()
+        with tempfile.TemporaryDirectory() as tmp:
+            links = collect_property_links_adaptive(server.search_url(), args.min_area, args.max_area, counts_file=os.path.join(tmp, 'counts.json'),
+                                                    concurrency=concurrency, qps=args.qps)
+        results.append(report(f'adaptive links, concurrency {concurrency}', time.perf_counter() - start, len(set(links)), server))
+
+        server.reset_stats()
+        start = time.perf_counter()
+        links = collect_property_links_async(server.search_url(), args.min_area, args.max_area, args.step, concurrency=concurrency, qps=args.qps)
+        results.append(report(f'fixed-step links, concurrency {concurrency}', time.perf_counter() - start, len(set(links)), server))
+
+    server.reset_stats()
+    start = time.perf_counter()
+    links = collect_property_links(server.search_url(), args.min_area, args.max_area, args.step, session=fast_session('search', args.qps))
+    results.append(report('sync links', time.perf_counter() - start, len(set(links)), server))
+    return results
+
+
+def bench_listings(server, args):
+    # the same steps as the 011 detail loop: fetch, read coordinates from the HTML, parse
+    session = fast_session('listing', args.qps)
+    urls = [server.url + path for path in server.ordered[:args.listings]]
+    server.reset_stats()
+    METRICS.reset()
+    parsed = 0
+    start = time.perf_counter()
+    for url in urls:
+        try:
+            r = session.get(url)
+            r.raise_for_status()
+            extract_coordinates_from_html(r.html.html, url)
+            with METRICS.timer('parse'):
+                data = parse_html_fast(r.html.html)
+            METRICS.record_fields(data)
+            parsed += 1
+        except CircuitOpenError as e:
+            print(f"Stopped: {e}")
+            break
+        except Exception as e:
+            print(f"Error collecting data for {url}: {e}")
+    return [report('listing loop', time.perf_counter() - start, parsed, server)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end scraping benchmark against a local hemnet stand-in.")
+    parser.add_argument('command', nargs='?', default='all', choices=['all', 'links', 'listings'])
+    parser.add_argument('--corpus', default='data/html/listings', help="directory of saved listing pages")
+    parser.add_argument('--archive', default=None, help="replay the HTML archive instead of --corpus")
+    parser.add_argument('--latency', type=float, nargs=2, default=[0.02, 0.1], metavar=('LOW', 'HIGH'), help="seconds added to every response")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of responses that are 503s")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="share of responses that are 429s")
+    parser.add_argument('--server-qps', type=float, default=None, help="answer requests above this rate with 429")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--qps', type=float, default=20.0, help="client request rate ceiling")
+    parser.add_argument('--min-area', type=int, default=20)
+    parser.add_argument('--max-area', type=int, default=250)
+    parser.add_argument('--step', type=int, default=10)
+    parser.add_argument('--listings', type=int, default=200, help="listing pages to scrape")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    options = dict(latency=tuple(args.latency), error_rate=args.error_rate, throttle_rate=args.throttle_rate, max_qps=args.server_qps, seed=args.seed)
+    server = StandinServer.from_archive(args.archive, **options) if args.archive else StandinServer.from_corpus(args.corpus, **options)
+    if not server.pages:
+        print(f"No pages in {args.archive or args.corpus}, run `python src/bench-parse-html.py record` first.")
+        return 1
+
+    with server:
+        print(f"Serving {len(server.pages)} listings at {server.url}")
+        results = []
+        if args.command in ('all', 'links'):
+            results += bench_links(server, args)
+        if args.command in ('all', 'listings'):
+            results += bench_listings(server, args)
+
+    with pd.option_context('display.width', 200, 'display.max_columns', None, 'display.max_colwidth', 60):
+        print(pd.DataFrame(results).to_string(index=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,58 @@
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+import pandas as pd
+
+from utils.dataset import load_properties
+from utils.pipeline import build_pipeline
+
+# this script measures the peak memory of the cleaning pipeline of 012-transform-gh-actions-sk-learn.py
+# with its steps copying the frame they are given (copy=True) and changing it in place
+# (copy=False), on the listings repeated --repeat times. Each mode runs in its own process, since a
+# process's peak RSS never goes down.
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run(copy, repeat):
+    data = pd.concat([load_properties()] * repeat, ignore_index=True)
+    size = data.memory_usage(deep=True).sum() / 2 ** 20
+    loaded = peak_rss_mb()
+    start = time.perf_counter()
+    transformed = build_pipeline(copy=copy).fit_transform(data)
+    seconds = time.perf_counter() - start
+    del data
+    return {'rows': len(transformed), 'data_mb': size, 'loaded_mb': loaded, 'peak_mb': peak_rss_mb(), 'seconds': seconds}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the peak memory of the transform pipeline with and without copies.")
+    parser.add_argument('--repeat', type=int, default=10, help="repeat the listings this many times")
+    parser.add_argument('--mode', choices=['copy', 'inplace'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.mode:
+        print(json.dumps(run(args.mode == 'copy', args.repeat)))
+        return 0
+
+    results = {}
+    for mode in ['copy', 'inplace']:
+        out = subprocess.run([sys.executable, __file__, '--mode', mode, '--repeat', str(args.repeat)],
+                             capture_output=True, text=True, check=True).stdout
+        results[mode] = json.loads(out.strip().splitlines()[-1])
+    print(f"{results['copy']['rows']} rows, {results['copy']['data_mb']:.0f}MB in memory")
+    # `loaded` is the peak before the transform, `during` how far the transform raised it
+    print(f"{'mode':8} {'loaded':>9} {'peak':>9} {'during':>9} {'time':>7}")
+    for mode, r in results.items():
+        print(f"{mode:8} {r['loaded_mb']:7.0f}MB {r['peak_mb']:7.0f}MB {r['peak_mb'] - r['loaded_mb']:7.0f}MB {r['seconds']:6.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
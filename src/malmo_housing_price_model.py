@@ -9,6 +9,9 @@ from sklearn.pipeline import Pipeline
 from sklearn.impute import SimpleImputer
 from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
 
+from utils.values import map_unique
+
+
 def load_and_preprocess_data(file_path):
     """Load and preprocess the Malmö housing dataset."""
     df = pd.read_csv(file_path, na_values='NA')
@@ -18,7 +21,7 @@ def load_and_preprocess_data(file_path):
     df = df[df['final_price'] < 15000000]  # Cap at reasonable upper limit
     
     # Extract neighborhood from location
-    df['neighborhood'] = df['location'].apply(lambda x: x.split(',')[0].strip() if isinstance(x, str) else None)
+    df['neighborhood'] = map_unique(df['location'], lambda locations: locations.str.split(',').str[0].str.strip())
     
     # Clean up year_of_construction
     df['year_of_construction'] = df['year_of_construction'].apply(
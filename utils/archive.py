@@ -0,0 +1,73 @@
+import gzip
+import hashlib
+import json
+import os
+import uuid
+
+import pandas as pd
+
+
+class HtmlArchive:
+    """Content-addressed, gzip-compressed store of every fetched page.
+
+    Pages are stored once per distinct content under objects/<sha256[:2]>/<sha256>.html.gz, and
+    index.jsonl gets one line per fetch with the url, the fetch time and the content hash, so the
+    same page fetched twice costs one index line and no extra storage.
+
+    The archive isn't committed; the scrape workflows carry it from one run to the next in the
+    GitHub Actions cache, together with the HTTP cache (utils/http_cache.py). GitHub drops entries
+    that go unused for a week and caps their total size, so that copy can be lost; keep a local
+    archive for src/011-reparse-archive.py rather than relying on it.
+    """
+
+    def __init__(self, root='data/html/archive'):
+        self.root = root
+        self.index_file = os.path.join(root, 'index.jsonl')
+
+    def object_path(self, digest):
+        return os.path.join(self.root, 'objects', digest[:2], digest + '.html.gz')
+
+    def put_object(self, html_content):
+        """Store a page's content without recording a fetch, and return its content hash."""
+        data = html_content.encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # write to a temporary file first so a crash never leaves a truncated object behind. The
+            # file has a name of its own, since shards storing the same page write it at the same time
+            tmp = f'{path}.{os.getpid()}-{uuid.uuid4().hex[:8]}.tmp'
+            try:
+                with gzip.open(tmp, 'wb', compresslevel=6) as f:
+                    f.write(data)
+                os.replace(tmp, path)
+            except BaseException:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                raise
+        return digest
+
+    def put(self, url, html_content, fetched_at=None):
+        """Store a fetched page and return its content hash."""
+        digest = self.put_object(html_content)
+        data = html_content.encode('utf-8')
+        fetched_at = fetched_at or pd.Timestamp.now(tz='UTC').isoformat()
+        with open(self.index_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'url': url, 'fetched_at': fetched_at, 'sha256': digest, 'bytes': len(data)}) + '\n')
+        return digest
+
+    def get(self, digest):
+        """Return the page stored under a content hash."""
+        with gzip.open(self.object_path(digest), 'rb') as f:
+            return f.read().decode('utf-8')
+
+    def index(self):
+        """Return every fetch in the archive as a DataFrame."""
+        if not os.path.exists(self.index_file):
+            return pd.DataFrame(columns=['url', 'fetched_at', 'sha256', 'bytes'])
+        return pd.read_json(self.index_file, lines=True, dtype={'fetched_at': str})
+
+    def latest(self):
+        """Return the most recent fetch of every url."""
+        index = self.index()
+        return index.sort_values('fetched_at').drop_duplicates('url', keep='last').reset_index(drop=True)
@@ -0,0 +1,132 @@
+import json
+import logging
+import queue
+import random
+import threading
+import time
+
+from selenium import webdriver
+from selenium.webdriver.chrome.options import Options
+
+from utils.scraper import extract_coordinates_from_request
+
+# requests the listing page doesn't need: images, fonts and analytics. The Google Maps API call that
+# carries the coordinates (SingleImageSearch) is deliberately not on this list.
+BLOCKED_URLS = [
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.avif', '*.svg', '*.ico',
+    '*.woff', '*.woff2', '*.ttf', '*.otf',
+    '*google-analytics.com*', '*googletagmanager.com*', '*doubleclick.net*', '*facebook.net*',
+    '*hotjar.com*', '*usercentrics.eu*',
+]
+
+
+def setup_selenium_driver():
+    chrome_options = Options()
+    chrome_options.add_argument("--headless=new")
+    chrome_options.add_argument("--disable-gpu")
+    chrome_options.add_argument("--window-size=1920x1080")
+    chrome_options.add_argument("--no-sandbox")  # <- Safe in CI
+    chrome_options.add_argument("--disable-dev-shm-usage")  # Prevents crashes on GitHub runners
+    # return from driver.get() once the DOM is ready; we wait for the map request ourselves
+    chrome_options.page_load_strategy = 'eager'
+
+    chrome_options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+
+    driver = webdriver.Chrome(options=chrome_options)
+    driver.execute_cdp_cmd('Network.enable', {})
+    driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': BLOCKED_URLS})
+    return driver
+
+
+def wait_for_coordinates(driver, timeout=10, poll=0.25):
+    """Wait until the page sends its SingleImageSearch request and return the coordinates in it, or None after `timeout` seconds."""
+    deadline = time.monotonic() + timeout
+    while True:
+        # each call only returns the entries logged since the last one
+        for entry in driver.get_log("performance"):
+            message = entry["message"]
+            # only the handful of entries that mention the map request are worth decoding
+            if "SingleImageSearch" not in message or "Network.requestWillBeSent" not in message:
+                continue
+            try:
+                request = json.loads(message)["message"]["params"]["request"]
+            except (ValueError, KeyError) as e:
+                logging.error(f"Error processing log entry: {e}")
+                continue
+            if "SingleImageSearch" in request.get("url", "") and "postData" in request:
+                coordinates = extract_coordinates_from_request(request["postData"])
+                if coordinates:
+                    return coordinates
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(poll)
+
+
+def load_listing(driver, url, timeout=10):
+    """Load a listing once and return its page source together with the coordinates from the map request."""
+    # throw away whatever the previous page left in the log
+    driver.get_log("performance")
+    driver.get(url)
+    coordinates = wait_for_coordinates(driver, timeout)
+    return driver.page_source, coordinates
+
+
+def extract_coordinates_from_selenium(driver, url, timeout=10):
+    """Extract coordinates from Google Maps API requests using Selenium."""
+    try:
+        return load_listing(driver, url, timeout)[1]
+    except Exception as e:
+        logging.error(f"Error extracting coordinates: {e}")
+        return None
+
+
+class BrowserPool:
+    """N headless Chrome instances working through a shared queue of listing urls.
+
+    Each driver loads a listing once and hands back (url, page_source, coordinates), or
+    (url, None, None) if the page failed to load, so the HTML never has to be fetched separately.
+    """
+
+    def __init__(self, size=2, timeout=10, delay=(5, 10)):
+        self.size = size
+        self.timeout = timeout
+        self.delay = delay
+
+    def worker(self, urls, results):
+        driver = None
+        try:
+            driver = setup_selenium_driver()
+            while True:
+                try:
+                    url = urls.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    html_content, coordinates = load_listing(driver, url, self.timeout)
+                    results.put((url, html_content, coordinates))
+                except Exception as e:
+                    logging.error(f"Error loading {url}: {e}")
+                    results.put((url, None, None))
+                # each driver keeps its own polite pace, so the pool as a whole scales with its size
+                time.sleep(random.uniform(*self.delay))
+        except Exception as e:
+            logging.error(f"Browser worker stopped: {e}")
+        finally:
+            if driver is not None:
+                driver.quit()
+
+    def map(self, urls):
+        """Yield (url, page_source, coordinates) for every url, in the order they finish."""
+        url_queue = queue.Queue()
+        for url in urls:
+            url_queue.put(url)
+        results = queue.Queue()
+        threads = [threading.Thread(target=self.worker, args=(url_queue, results), daemon=True) for _ in range(self.size)]
+        for thread in threads:
+            thread.start()
+
+        while any(thread.is_alive() for thread in threads) or not results.empty():
+            try:
+                yield results.get(timeout=1)
+            except queue.Empty:
+                continue
@@ -0,0 +1,389 @@
+import asyncio
+import json
+import os
+import time
+from math import ceil
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from utils.scraper import search_url, area_ranges, extract_property_links, extract_total_results, RESULTS_PER_PAGE
+from utils.metrics import METRICS
+from utils.listing_index import ListingIndex, listing_ids
+from utils.session import RateController, CircuitBreaker, CircuitOpenError, RETRYABLE_STATUSES, retry_delay
+
+# browser-like headers so the async session looks like the HTMLSession it replaces
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_12_6) AppleWebKit/603.3.8 (KHTML, like Gecko) Version/10.1.2 Safari/603.3.8',
+    'Accept-Language': 'sv-SE,sv;q=0.9,en;q=0.8',
+}
+
+
+class TokenBucket:
+    """Token bucket that lets at most `rate` requests per second through, with bursts up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        # the lock makes waiting requests queue up in order instead of racing for tokens
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AsyncFetcher:
+    """Fetch many pages at once, capped by a global concurrency limit and a per-host QPS limit.
+
+    Below that ceiling a RateController adapts the pace to how the site responds, failed requests
+    are retried with jittered backoff and a CircuitBreaker pauses fetching after repeated failures.
+    """
+
+    def __init__(self, concurrency=8, qps=2.0, timeout=30, headers=None, cache=None, controller=None, breaker=None, max_retries=3, stage='search'):
+        self.concurrency = concurrency
+        self.cache = cache
+        self.qps = qps
+        self.timeout = timeout
+        self.headers = headers if headers is not None else DEFAULT_HEADERS
+        self.controller = controller if controller is not None else RateController(initial_qps=qps, min_qps=qps / 20, max_qps=qps)
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.max_retries = max_retries
+        self.stage = stage
+        self.buckets = {}
+        self.semaphore = None
+        self.session = None
+
+    async def __aenter__(self):
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.session = aiohttp.ClientSession(
+            headers=self.headers,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            connector=aiohttp.TCPConnector(limit=self.concurrency),
+        )
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    def bucket(self, url):
+        host = urlsplit(url).netloc
+        if host not in self.buckets:
+            self.buckets[host] = TokenBucket(self.qps)
+        return self.buckets[host]
+
+    async def fetch(self, url):
+        """Return the HTML of `url`, or None if the request failed."""
+        # pages the cache still considers fresh don't need a request at all
+        entry = self.cache.lookup(url) if self.cache is not None else None
+        if entry is not None and self.cache.is_fresh(url, entry):
+            try:
+                return self.cache.hit(url, entry)
+            except Exception as e:
+                # the cached body is missing or corrupt, so the page is fetched again without validators
+                print(f"Cached copy of {url} can't be read, fetching it again. Error: {e}")
+                entry = None
+
+        async with self.semaphore:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    await asyncio.sleep(self.breaker.pause())
+                except CircuitOpenError as e:
+                    print(f"Error fetching {url}. Error: {e}")
+                    return None
+                await self.controller.wait_async()
+                await self.bucket(url).acquire()
+
+                start = time.monotonic()
+                status, retry_after = None, None
+                try:
+                    headers = self.cache.conditional_headers(entry) if self.cache is not None else None
+                    async with self.session.get(url, headers=headers) as r:
+                        status = r.status
+                        if r.status == 304 and entry is not None:
+                            html = self.cache.hit(url, entry, revalidated=True, headers=r.headers)
+                        elif r.status in RETRYABLE_STATUSES:
+                            retry_after = r.headers.get('Retry-After')
+                            raise aiohttp.ClientResponseError(r.request_info, r.history, status=r.status, message=r.reason)
+                        else:
+                            r.raise_for_status()
+                            html = await r.text()
+                            if self.cache is not None:
+                                self.cache.store(url, html, r.headers)
+                    self.controller.record(status, time.monotonic() - start)
+                    METRICS.record_request(self.stage, status, time.monotonic() - start, len(html.encode('utf-8')) if status == 200 else 0)
+                    self.breaker.record(True)
+                    return html
+                except Exception as e:
+                    self.controller.record(status, time.monotonic() - start)
+                    METRICS.record_request(self.stage, status, time.monotonic() - start)
+                    # a 404 or similar won't get better by asking again
+                    if status is not None and status not in RETRYABLE_STATUSES:
+                        print(f"Error fetching {url}. Error: {e}")
+                        return None
+                    self.breaker.record(False)
+                    if attempt == self.max_retries:
+                        print(f"Error fetching {url} after {attempt + 1} attempts. Error: {e}")
+                        return None
+                    await asyncio.sleep(retry_delay(attempt, retry_after))
+
+    async def fetch_all(self, urls):
+        """Fetch all `urls` concurrently and return their HTML in the same order."""
+        return await asyncio.gather(*(self.fetch(url) for url in urls))
+
+
+# function to collect the links from a list of search page urls, keeping the order of the urls
+async def collect_links_from_pages(fetcher, urls):
+    property_links = []
+    for url, html in zip(urls, await fetcher.fetch_all(urls)):
+        if html is None:
+            continue
+        property_links.extend(extract_property_links(html))
+        print(f"Collected links from {url}")
+    return property_links
+
+
+# function to collect the links from a list of living area ranges, keeping range then page order.
+# `counts` holds already known result counts per range and `first_pages` already fetched first pages,
+# so a range whose count is known costs exactly one request per page
+async def collect_links_from_ranges(fetcher, base_url, ranges, counts=None, first_pages=None):
+    counts = dict(counts or {})
+    pages = {r: {1: first_pages[r]} for r in (first_pages or {}) if r in ranges}
+
+    # ranges with no known count need their first page before we know how many pages to ask for
+    unknown = [r for r in ranges if counts.get(r) is None and r not in pages]
+    for r, html in zip(unknown, await fetcher.fetch_all([search_url(base_url, *r, page=1) for r in unknown])):
+        pages[r] = {1: html}
+
+    # fetch every page we know about, then top up any range whose first page reports more results
+    # than we expected (sold listings keep being added, so cached counts can be slightly behind)
+    while True:
+        wanted = []
+        for r in ranges:
+            first = pages.get(r, {}).get(1)
+            total_results = extract_total_results(first) if first is not None else None
+            if total_results is None:
+                total_results = counts.get(r)
+            if total_results is None:
+                if r in pages:
+                    print(f"Warning: Could not find total results for size range {r[0]}-{r[1]}")
+                continue
+            counts[r] = total_results
+            wanted.extend((r, page) for page in range(1, ceil(total_results / RESULTS_PER_PAGE) + 1) if page not in pages.get(r, {}))
+        if not wanted:
+            break
+        htmls = await fetcher.fetch_all([search_url(base_url, *r, page=page) for r, page in wanted])
+        for (r, page), html in zip(wanted, htmls):
+            pages.setdefault(r, {})[page] = html
+
+    property_links = []
+    for lo, hi in ranges:
+        for page, html in sorted(pages.get((lo, hi), {}).items()):
+            if html is not None:
+                property_links.extend(extract_property_links(html))
+        print(f"Collected links for size range {lo}-{hi}")
+    return property_links, counts
+
+
+async def _collect_property_links(base_url, min_area, max_area, step, concurrency, qps, cache):
+    async with AsyncFetcher(concurrency=concurrency, qps=qps, cache=cache) as fetcher:
+        property_links, _ = await collect_links_from_ranges(fetcher, base_url, area_ranges(min_area, max_area, step))
+    return property_links
+
+
+def collect_property_links_async(base_url, min_area, max_area, step, concurrency=8, qps=2.0, cache=None):
+    """Concurrent version of collect_property_links, returning the same list of links."""
+    return asyncio.run(_collect_property_links(base_url, min_area, max_area, step, concurrency, qps, cache))
+
+
+async def _collect_property_links_gh_actions(base_url, total_pages, concurrency, qps, cache):
+    async with AsyncFetcher(concurrency=concurrency, qps=qps, cache=cache) as fetcher:
+        urls = [search_url(base_url, page=page) for page in range(1, total_pages + 1)]
+        return await collect_links_from_pages(fetcher, urls)
+
+
+def collect_property_links_gh_actions_async(base_url, total_pages=10, concurrency=8, qps=2.0, cache=None):
+    """Concurrent version of collect_property_links_gh_actions, returning the same list of links."""
+    return asyncio.run(_collect_property_links_gh_actions(base_url, total_pages, concurrency, qps, cache))
+
+
+
+async def _collect_new_property_links(base_url, known, stop_after, max_pages, qps, cache):
+    property_links = []
+    known_pages = 0
+    async with AsyncFetcher(concurrency=1, qps=qps, cache=cache) as fetcher:
+        # pages are fetched one at a time, newest sales first, so we can stop as soon as we catch up
+        for page in range(1, max_pages + 1):
+            html = await fetcher.fetch(search_url(base_url, page=page))
+            if html is None:
+                continue
+            links = extract_property_links(html)
+            if not links:
+                print(f"No links on page {page}, reached the end of the results")
+                break
+            property_links.extend(links)
+            new_links = [link for link, is_known in zip(links, known.contains(listing_ids(links))) if not is_known]
+            print(f"Collected links from page {page}, {len(new_links)} of {len(links)} are new")
+
+            known_pages = known_pages + 1 if not new_links else 0
+            if known_pages >= stop_after:
+                print(f"Stopping after {known_pages} page(s) with only known listings")
+                break
+    return property_links
+
+
+def collect_new_property_links(base_url, known_urls, stop_after=1, max_pages=50, qps=1.0, cache=None):
+    """Page through the search results until `stop_after` consecutive pages hold only known listings.
+
+    `known_urls` is a ListingIndex, or any list of urls to build one from.
+    """
+    known = known_urls if isinstance(known_urls, ListingIndex) else ListingIndex.from_urls(known_urls)
+    return asyncio.run(_collect_new_property_links(base_url, known, stop_after, max_pages, qps, cache))
+
+# hemnet stops paginating after 50 pages, so a search can never show more than this many results
+MAX_RESULTS = 2500
+# how often a range's first page is fetched before its count is given up on
+PROBE_ATTEMPTS = 2
+
+
+# function to load the probed result counts for a search from the counts cache
+def load_range_counts(counts_file, base_url, max_age_days=7):
+    if not os.path.exists(counts_file):
+        return {}
+    with open(counts_file) as f:
+        cached = json.load(f).get(base_url, {})
+    # sold listings keep being added, so old counts are dropped and probed again
+    oldest = time.time() - max_age_days * 86400
+    counts = {}
+    for key, entry in cached.items():
+        if entry['probed'] >= oldest:
+            lo, hi = key.split('-')
+            counts[(int(lo), int(hi))] = entry['count']
+    return counts
+
+
+# function to write the probed result counts for a search back to the counts cache
+def save_range_counts(counts_file, base_url, counts):
+    cached = {}
+    if os.path.exists(counts_file):
+        with open(counts_file) as f:
+            cached = json.load(f)
+    entries = cached.setdefault(base_url, {})
+    now = time.time()
+    for (lo, hi), count in counts.items():
+        if count is not None:
+            entries[f"{lo}-{hi}"] = {'count': count, 'probed': now}
+    os.makedirs(os.path.dirname(counts_file) or '.', exist_ok=True)
+    with open(counts_file, 'w') as f:
+        json.dump(cached, f, indent=2, sort_keys=True)
+
+
+# function to merge adjacent ranges while their combined count stays under the limit
+def merge_sparse_ranges(ranges, counts, limit):
+    merged = []
+    merged_counts = {}
+    for lo, hi in sorted(ranges):
+        count = counts.get((lo, hi))
+        if merged and count is not None:
+            prev_lo, prev_hi = merged[-1]
+            prev_count = merged_counts[merged[-1]]
+            if prev_count is not None and prev_hi + 1 == lo and prev_count + count <= limit:
+                del merged_counts[merged[-1]]
+                merged[-1] = (prev_lo, hi)
+                merged_counts[merged[-1]] = prev_count + count
+                continue
+        merged.append((lo, hi))
+        merged_counts[(lo, hi)] = count
+    return merged, merged_counts
+
+
+async def partition_area_ranges(fetcher, base_url, min_area, max_area, initial_step=50, cap=MAX_RESULTS, fill=0.9, counts=None):
+    """Split min_area..max_area into as few ranges as possible that each stay under the pagination cap.
+
+    Starts from wide ranges of `initial_step` m², bisects every range whose result count is over `cap`
+    and then merges neighbouring sparse ranges back together as long as they stay under `fill * cap`,
+    leaving some headroom for listings sold after the counts were probed. Counts already in `counts`
+    are not probed again. Returns the ranges, the counts for every probed or merged range and the
+    first pages fetched while probing, which the crawl can reuse.
+    """
+    counts = dict(counts or {})
+    first_pages = {}
+    attempts = {}
+    settled = []
+    pending = [(lo, min(lo + initial_step - 1, max_area)) for lo in range(min_area, max_area + 1, initial_step)]
+    while pending:
+        unknown = [r for r in pending if counts.get(r) is None]
+        htmls = await fetcher.fetch_all([search_url(base_url, *r, page=1) for r in unknown])
+        for r, html in zip(unknown, htmls):
+            attempts[r] = attempts.get(r, 0) + 1
+            count = extract_total_results(html) if html is not None else None
+            if count is None and html is not None:
+                # a single page of results has no pagination to read the count from
+                links = extract_property_links(html)
+                count = len(links) if links else None
+            if count is not None:
+                first_pages[r] = html
+                counts[r] = count
+
+        next_pending = []
+        for lo, hi in pending:
+            count = counts.get((lo, hi))
+            if count is None and attempts.get((lo, hi), 0) < PROBE_ATTEMPTS:
+                # a blocked page or changed markup isn't a count of 0; probe the range again, and
+                # after that leave it uncounted (so uncached) for the crawl to page through
+                next_pending.append((lo, hi))
+                continue
+            if count is not None and count > cap and lo < hi:
+                mid = (lo + hi) // 2
+                next_pending.extend([(lo, mid), (mid + 1, hi)])
+                continue
+            if count is not None and count > cap:
+                print(f"Warning: size range {lo}-{hi} has {count} results, more than the {cap} that can be paged through")
+            settled.append((lo, hi))
+        pending = next_pending
+
+    ranges, range_counts = merge_sparse_ranges(settled, counts, int(cap * fill))
+    counts.update(range_counts)
+    return ranges, counts, first_pages
+
+
+# function to estimate how many search page requests a crawl of the ranges will make
+def estimate_requests(ranges, counts, first_pages):
+    total = 0
+    for r in ranges:
+        count = counts.get(r)
+        pages = ceil(count / RESULTS_PER_PAGE) if count is not None else 1
+        total += pages - (1 if r in first_pages else 0)
+    return total
+
+
+async def _collect_property_links_adaptive(base_url, min_area, max_area, initial_step, counts_file, max_age_days, concurrency, qps, cache):
+    cached_counts = load_range_counts(counts_file, base_url, max_age_days)
+    async with AsyncFetcher(concurrency=concurrency, qps=qps, cache=cache) as fetcher:
+        ranges, counts, first_pages = await partition_area_ranges(fetcher, base_url, min_area, max_area, initial_step, counts=cached_counts)
+        save_range_counts(counts_file, base_url, {r: c for r, c in counts.items() if r not in cached_counts})
+
+        print(f"Probed {len(first_pages)} size ranges ({len(cached_counts)} counts from cache), "
+              f"split {min_area}-{max_area} m² into {len(ranges)} ranges.")
+        print(f"Estimated {estimate_requests(ranges, counts, first_pages)} more requests to collect "
+              f"{sum(counts.get(r) or 0 for r in ranges)} links.")
+
+        property_links, crawled_counts = await collect_links_from_ranges(fetcher, base_url, ranges, counts, first_pages)
+    # the first page of every crawled range reports its current count, which keeps the cache fresh
+    save_range_counts(counts_file, base_url, crawled_counts)
+    return property_links
+
+
+def collect_property_links_adaptive(base_url, min_area, max_area, initial_step=50, counts_file='data/interim/area_range_counts.json',
+                                    max_age_days=7, concurrency=8, qps=2.0, cache=None):
+    """Collect every link between min_area and max_area using adaptively sized living area ranges."""
+    return asyncio.run(_collect_property_links_adaptive(base_url, min_area, max_area, initial_step, counts_file, max_age_days, concurrency, qps, cache))
@@ -0,0 +1,225 @@
+import glob
+import os
+import re
+import shutil
+import uuid
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from utils.listing_index import listing_ids
+from utils.storage import conform_table, load_parquet
+from utils.schemas import ARTIFACTS, unify_schemas
+from utils.values import SWEDISH_MONTHS
+
+# the scraped properties, partitioned by sale year and month
+PROPERTIES_DATASET = 'data/interim/properties'
+# the single file they were kept in before, imported into the dataset by the first 011 run
+LEGACY_CACHE = 'data/interim/hemnet_properties_cache.parquet'
+# the fields 011 scrapes for a listing; a listing whose values in these change has to be transformed again
+RAW_COLUMNS = ['url', 'Title', 'Type', 'Location', 'Sale Date', 'Agent Name', 'Agent Link', 'Slutpris', 'Pris per kvadratmeter',
+               'Utgångspris', 'Prisutveckling', 'Bostadstyp', 'Upplåtelseform', 'Antal rum', 'Boarea', 'Balkong', 'Våning',
+               'Byggår', 'Avgift', 'Driftskostnad', 'Uteplats', 'Biarea', 'Tomtarea', 'Arrende', 'Förening', 'Tomträttsavgäld']
+
+PARTITIONING = ds.partitioning(pa.schema([('sale_year', pa.int32()), ('sale_month', pa.int32())]), flavor='hive')
+
+
+def sale_year_month(sale_dates):
+    """Return the sale year and month of every 'Såld 12 mars 2024' string, with 0 where there is no date."""
+    parts = pd.Series(sale_dates, dtype=object).reset_index(drop=True).str.extract(r'(\d{1,2}) ([a-zåäö]+) (\d{4})')
+    years = pd.to_numeric(parts[2], errors='coerce').fillna(0).astype(int)
+    months = parts[1].str.lower().map(SWEDISH_MONTHS).fillna(0).astype(int)
+    # a year without a month we recognise goes in month 0 of that year
+    return years.to_numpy(), months.to_numpy()
+
+
+def _write_stamp():
+    # every file name starts with the time it was written, so files sort oldest first
+    return pd.Timestamp.now(tz='UTC').strftime('%Y%m%dT%H%M%S%f')
+
+
+def _stamp(path):
+    # files written before their names had a stamp sort before all others
+    match = re.match(r'part-(\d{8}T\d{12})-', os.path.basename(path))
+    return match.group(1) if match else ''
+
+
+def _null_empty_columns(table):
+    # a column with no values in this file gets the null type, which unifies with whatever type the
+    # other files have (pandas would make it float64, which doesn't unify with strings)
+    for i, column in enumerate(table.columns):
+        if column.null_count == len(column) and column.type != pa.null():
+            table = table.set_column(i, table.field(i).name, pa.nulls(len(column)))
+    return table
+
+
+class PartitionedDataset:
+    """Append-only, hive-partitioned Parquet dataset (sale_year=YYYY/sale_month=M/part-*.parquet).
+
+    Every append writes new files into the partitions its rows belong to and never touches the
+    existing ones, so a run costs as much as the rows it adds. Listings without a sale date go in
+    sale_year=0/sale_month=0. The files may have different columns; read() unifies them into one
+    table, and compact() merges each partition's files into one with the dataset-wide schema.
+
+    Files are named part-<time written>-<run id>-<random>.parquet and always listed and read
+    oldest first, so of two copies of a listing the last one read is the latest scrape.
+    """
+
+    def __init__(self, root=PROPERTIES_DATASET, artifact=ARTIFACTS['properties']):
+        self.root = root
+        self.artifact = artifact
+
+    def files(self, run_id=None):
+        """Return every data file, or only those written by the run `run_id`, oldest first."""
+        files = glob.glob(os.path.join(self.root, 'sale_year=*', 'sale_month=*', '*.parquet'))
+        if run_id:
+            name = re.compile(r'part-(?:\d{8}T\d{12}-)?' + re.escape(run_id) + r'-[0-9a-f]{8}\.parquet')
+            files = [f for f in files if name.fullmatch(os.path.basename(f))]
+        return sorted(files, key=lambda f: (_stamp(f), f))
+
+    def partitions(self):
+        """Return {partition directory: [files]}."""
+        partitions = {}
+        for f in self.files():
+            partitions.setdefault(os.path.dirname(f), []).append(f)
+        return partitions
+
+    def __len__(self):
+        return sum(pq.ParquetFile(f).metadata.num_rows for f in self.files())
+
+    def schema(self, files=None):
+        """Return the union of the schemas of all files."""
+        schemas = [pq.read_schema(f).remove_metadata() for f in (files if files is not None else self.files())]
+        if not schemas:
+            return pa.schema([])
+        return unify_schemas(schemas)
+
+    def append(self, df, run_id=None):
+        """Write `df` as new files, one per partition its rows fall in, and return their paths."""
+        if df.empty:
+            return []
+        stamp = _write_stamp()
+        run_id = run_id or stamp[:15]
+        years, months = sale_year_month(df['Sale Date'] if 'Sale Date' in df.columns else [None] * len(df))
+        df = df.reset_index(drop=True)
+        written = []
+        for (year, month), rows in df.groupby([years, months]).groups.items():
+            directory = os.path.join(self.root, f'sale_year={year}', f'sale_month={month}')
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f'part-{stamp}-{run_id}-{uuid.uuid4().hex[:8]}.parquet')
+            table = _null_empty_columns(self.artifact.to_table(df.loc[rows]))
+            # written under a temporary name first, so readers never see half a file
+            pq.write_table(table, path + '.tmp', **self.artifact.write_options())
+            os.replace(path + '.tmp', path)
+            written.append(path)
+        return written
+
+    def to_dataset(self, run_id=None):
+        """Return the files as one pyarrow dataset with the unified schema and the partition columns, or None if there are none."""
+        files = self.files(run_id)
+        if not files:
+            return None
+        schema = self.schema(files)
+        self.artifact.check(schema, self.root)
+        for field in PARTITIONING.schema:
+            schema = schema.append(field)
+        return ds.dataset(files, schema=schema, format='parquet', partitioning=PARTITIONING, partition_base_dir=self.root)
+
+    def read(self, columns=None, filters=None, partition_columns=False, run_id=None):
+        """Read the whole dataset, or what the run `run_id` wrote, as one DataFrame.
+
+        `filters` is a pyarrow.dataset expression or a list of filters like load_parquet takes,
+        e.g. [('sale_year', '>=', 2023)]. Filters on sale_year/sale_month skip whole partitions, and
+        only `columns` are read. The partition columns are only included on request.
+        """
+        dataset = self.to_dataset(run_id)
+        if dataset is None:
+            return pd.DataFrame(columns=columns or [])
+        schema = dataset.schema
+        if columns is not None:
+            columns = [c for c in columns if c in schema.names]
+        elif not partition_columns:
+            columns = [c for c in schema.names if c not in PARTITIONING.schema.names]
+        if isinstance(filters, list):
+            filters = pq.filters_to_expression(filters)
+        return dataset.to_table(columns=columns, filter=filters).to_pandas()
+
+    def ids(self):
+        """Return the listing ids of every row."""
+        df = self.read(columns=['url'])
+        return listing_ids(df['url']) if 'url' in df.columns else np.empty(0, dtype=np.int64)
+
+    def compact(self, min_files=2, on_merged=None):
+        """Merge the files of every partition with at least `min_files` files into one file.
+
+        All merged files get the dataset-wide schema, and a listing that ended up in a partition
+        twice is kept once (the latest copy). The merged file is written before the old ones are
+        removed, so a crash can at worst leave a duplicate, which the next compaction removes.
+        `on_merged(merged file, [files it replaces])` is called for each partition before its old
+        files are removed, so a crash later on can't lose track of where their rows went.
+        Returns a (merged file, [files it replaces]) pair for every partition it compacted.
+        """
+        schema = self.schema()
+        merged = []
+        for directory, files in self.partitions().items():
+            if len(files) < min_files:
+                continue
+            table = pa.concat_tables([conform_table(pq.read_table(f).replace_schema_metadata(None), schema) for f in files])
+            if 'url' in schema.names:
+                ids = listing_ids(table.column('url').to_pylist())
+                keep = ~pd.Series(ids).duplicated(keep='last').to_numpy()
+                table = table.filter(pa.array(keep))
+            # stamped like the newest of the merged files, so files appended since still sort after it
+            stamp = max(_stamp(f) for f in files)
+            path = os.path.join(directory, f"part-{stamp + '-' if stamp else ''}compacted-{uuid.uuid4().hex[:8]}.parquet")
+            pq.write_table(table, path + '.tmp', **self.artifact.write_options())
+            os.replace(path + '.tmp', path)
+            if on_merged is not None:
+                on_merged(path, files)
+            for f in files:
+                os.remove(f)
+            merged.append((path, files))
+        return merged
+
+    def replace(self, df):
+        """Swap the whole dataset for `df`, e.g. after re-parsing every listing."""
+        tmp = PartitionedDataset(self.root.rstrip('/') + '.tmp', self.artifact)
+        if os.path.exists(tmp.root):
+            shutil.rmtree(tmp.root)
+        tmp.append(df, run_id='rebuilt')
+        old = self.root.rstrip('/') + '.old'
+        if os.path.exists(self.root):
+            os.replace(self.root, old)
+        os.replace(tmp.root, self.root)
+        if os.path.exists(old):
+            shutil.rmtree(old)
+
+    def import_files(self, paths, run_id='imported'):
+        """Append the rows of older flat Parquet files that the dataset doesn't have yet; return how many were added."""
+        known = set(self.ids())
+        added = 0
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            df = pd.read_parquet(path)
+            if 'url' in df.columns:
+                ids = listing_ids(df['url'])
+                keep = ~pd.Series(ids).duplicated(keep='last').to_numpy() & ~np.isin(ids, np.fromiter(known, dtype=np.int64, count=len(known)))
+                df = df[keep]
+                known.update(ids[keep])
+            self.append(df, run_id=run_id)
+            added += len(df)
+        return added
+
+
+def load_properties(root=PROPERTIES_DATASET, columns=None, filters=None):
+    """Load the scraped properties as one DataFrame, reading only `columns` and the rows `filters` allow."""
+    dataset = PartitionedDataset(root)
+    if not dataset.files() and root == PROPERTIES_DATASET and os.path.exists(LEGACY_CACHE):
+        # nothing has been scraped into the dataset yet, so the old cache is still the latest data
+        # (it has no sale_year/sale_month columns to filter on)
+        return load_parquet(LEGACY_CACHE, columns=columns, filters=filters)
+    return dataset.read(columns=columns, filters=filters)
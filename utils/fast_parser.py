@@ -0,0 +1,156 @@
+import logging
+import re
+
+import lxml.etree
+import lxml.html
+
+from utils.scraper import parse_html
+
+# how often the fast path has been used and how often it had to hand over to parse_html
+FAST_PARSE_STATS = {'fast': 0, 'fallback': 0, 'mismatch': 0}
+
+# the text nodes that BeautifulSoup's .text includes, i.e. everything except comments, scripts and styles
+_TEXT = lxml.etree.XPath('.//text()[not(ancestor::script) and not(ancestor::style)]')
+
+# the same pattern parse_html uses for "Lägenhet - Gamla Väster, Malmö kommun - Såld 26 februari 2024"
+_TYPE_LOCATION_DATE = re.compile(r"^(.*?) - (.*?) - Såld (.*)$")
+
+_TAG_BOUNDARIES = {}
+
+
+# function to find the end of the element that opens at `start`, by counting nested tags of the same name
+def _element_end(html_content, tag, start):
+    if tag not in _TAG_BOUNDARIES:
+        _TAG_BOUNDARIES[tag] = re.compile(r'<(/?)%s[\s>/]' % tag, re.IGNORECASE)
+    depth = 0
+    for match in _TAG_BOUNDARIES[tag].finditer(html_content, start):
+        depth += -1 if match.group(1) else 1
+        if depth == 0:
+            end = html_content.find('>', match.end() - 1)
+            return end + 1 if end != -1 else None
+    return None
+
+
+# function to parse only the first <tag> whose opening tag mentions `marker` and that passes `check`,
+# instead of building a tree for the whole page
+def _find_subtree(html_content, tag, marker, check):
+    position = html_content.find(marker)
+    while position != -1:
+        start = html_content.rfind('<' + tag, 0, position)
+        # the marker has to sit inside the opening tag itself, not in text, scripts or styles after it
+        if start != -1 and html_content[start + len(tag) + 1] in ' \t\r\n>/' and html_content.find('>', start) > position:
+            end = _element_end(html_content, tag, start)
+            if end is not None:
+                element = lxml.html.fragment_fromstring(html_content[start:end])
+                if check(element):
+                    return element
+        position = html_content.find(marker, position + 1)
+    return None
+
+
+def _has_class(element, class_name):
+    return class_name in element.get('class', '').split()
+
+
+# BeautifulSoup matches a class_ containing spaces against the whole class attribute
+def _has_classes(element, class_names):
+    return ' '.join(element.get('class', '').split()) == class_names
+
+
+# function to find the first descendant (or the element itself) with the given tag and class
+def _find(element, tag, class_name):
+    for candidate in element.iter(tag):
+        if _has_class(candidate, class_name):
+            return candidate
+    return None
+
+
+def _text(element):
+    return ''.join(_TEXT(element))
+
+
+# equivalent of BeautifulSoup's get_text(strip=True)
+def _stripped_text(element):
+    return ''.join(text.strip() for text in _TEXT(element) if text.strip())
+
+
+def _parse_html_fast(html_content):
+    data = {}
+
+    # Extract the final price
+    final_price_container = _find_subtree(html_content, 'div', 'SaleAttributes_sellingPrice__iFujI',
+                                          lambda e: _has_class(e, 'SaleAttributes_sellingPrice__iFujI'))
+    if final_price_container is not None:
+        final_price_spans = [span for span in final_price_container.iter('span') if _has_class(span, 'SaleAttributes_sellingPriceText__UZF0W')]
+        data['Slutpris'] = _text(final_price_spans[1]).replace(u'\xa0', u' ')
+
+    # Extract the title (h1 tag)
+    title_tag = _find_subtree(html_content, 'h1', 'hcl-heading', lambda e: _has_class(e, 'hcl-heading'))
+    if title_tag is not None:
+        data['Title'] = _text(title_tag).strip()
+
+    # Extract the property type, location and sale date
+    type_location_date_container = _find_subtree(html_content, 'div', 'ListingContent_paddedContainer__OC_QR',
+                                                 lambda e: _has_class(e, 'ListingContent_paddedContainer__OC_QR'))
+    if type_location_date_container is not None:
+        type_location_date_text = _text(_find(type_location_date_container, 'p', 'hcl-text')).strip()
+        match = _TYPE_LOCATION_DATE.search(type_location_date_text)
+        if match:
+            data['Type'] = match.group(1)
+            data['Location'] = match.group(2)
+            data['Sale Date'] = "Såld " + match.group(3)
+        else:
+            print("The expected pattern was not found in the text: {}".format(type_location_date_text))
+
+    # Extract the real estate agent information
+    agent_info_container = _find_subtree(html_content, 'div', 'maklarinfo', lambda e: e.get('id') == 'maklarinfo')
+    if agent_info_container is not None:
+        agent_name_tag = _find(agent_info_container, 'a', 'hcl-link')
+        if agent_name_tag is not None:
+            data['Agent Name'] = _text(agent_name_tag).strip()
+        data['Agent Link'] = agent_name_tag.get('href') if agent_name_tag is not None else None
+
+    # Extract the name/value pairs from the section with the aria-label 'information om bostaden'
+    section = _find_subtree(html_content, 'section', 'information om bostaden',
+                            lambda e: e.get('aria-label') == 'information om bostaden')
+    if section is not None:
+        for div in section.iter('div'):
+            if not _has_classes(div, 'hcl-flex--container hcl-flex--justify-space-between'):
+                continue
+            property_name_element = _find(div, 'p', 'hcl-text')
+            if property_name_element is not None:
+                property_name = _stripped_text(property_name_element)
+                property_value_element = _find(div, 'strong', 'hcl-text')
+                if property_value_element is not None:
+                    data[property_name] = _stripped_text(property_value_element).replace(u'\xa0', u' ')
+
+    return data
+
+
+def parse_html_fast(html_content, session=None, url=None, verify=False):
+    """Drop-in replacement for parse_html that only parses the parts of the page it reads.
+
+    Falls back to parse_html when the fast path fails, and with `verify=True` also runs
+    parse_html and returns its result whenever the two disagree.
+    """
+    # coordinates are captured through a browser session, which only parse_html knows how to drive
+    if session and url:
+        return parse_html(html_content, session=session, url=url)
+
+    try:
+        data = _parse_html_fast(html_content)
+    except Exception as e:
+        logging.warning(f"Fast parser failed, falling back to parse_html: {e}")
+        FAST_PARSE_STATS['fallback'] += 1
+        return parse_html(html_content)
+
+    if verify:
+        expected = parse_html(html_content)
+        if data != expected:
+            differing = sorted(k for k in data.keys() | expected.keys() if data.get(k) != expected.get(k))
+            logging.warning(f"Fast parser disagrees with parse_html on {differing}")
+            FAST_PARSE_STATS['mismatch'] += 1
+            return expected
+
+    FAST_PARSE_STATS['fast'] += 1
+    return data
@@ -0,0 +1,110 @@
+import os
+import sqlite3
+import threading
+import time
+
+from utils.listing_index import listing_id, listing_ids
+
+PENDING, IN_PROGRESS, DONE, FAILED = 'pending', 'in_progress', 'done', 'failed'
+
+
+class Frontier:
+    """Persistent crawl frontier: one row per listing with its state and retry schedule.
+
+    Rows are keyed on the int64 listing id (see utils/listing_index.py), so the same listing under
+    two spellings of its url is only crawled once; the methods take and return urls.
+
+    A url is pending until a worker leases it, which makes it in_progress until the lease runs
+    out; it then ends up done, back to pending with a later next_eligible time, or failed for good
+    after `max_attempts` tries or a permanent error. Leasing is an index range scan on
+    (state, next_eligible), so it doesn't get slower as the table grows, and a lease that was never
+    settled (a crashed worker) simply becomes eligible again when it expires.
+    """
+
+    def __init__(self, path='data/interim/frontier.sqlite', lease_seconds=3600, max_attempts=5, retry_base=6 * 3600):
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS frontier (
+            listing_id INTEGER PRIMARY KEY, url TEXT NOT NULL, state TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0,
+            next_eligible REAL NOT NULL DEFAULT 0, last_error TEXT, updated_at REAL)""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS frontier_state ON frontier (state, next_eligible)")
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM frontier").fetchone()[0]
+
+    def add(self, urls, state=PENDING):
+        """Add urls that aren't in the frontier yet; urls already in it keep their state. Return how many were added."""
+        now = time.time()
+        urls = list(urls)
+        with self.lock:
+            before = self.db.total_changes
+            self.db.execute("BEGIN")
+            self.db.executemany("INSERT OR IGNORE INTO frontier (listing_id, url, state, updated_at) VALUES (?, ?, ?, ?)",
+                                ((int(id_), url, state, now) for id_, url in zip(listing_ids(urls), urls)))
+            self.db.execute("COMMIT")
+            return self.db.total_changes - before
+
+    def lease(self, n):
+        """Claim up to `n` eligible urls, oldest first, and return them."""
+        now = time.time()
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            # an in_progress url is eligible again once its lease (stored as next_eligible) has run out.
+            # One query per state, so each is a range scan of the index in next_eligible order
+            urls = []
+            for state in (IN_PROGRESS, PENDING):
+                urls += self.db.execute(
+                    "SELECT listing_id, url FROM frontier WHERE state = ? AND next_eligible <= ? ORDER BY next_eligible LIMIT ?",
+                    (state, now, n - len(urls))).fetchall()
+            self.db.executemany("UPDATE frontier SET state = ?, next_eligible = ?, updated_at = ? WHERE listing_id = ?",
+                                ((IN_PROGRESS, now + self.lease_seconds, now, id_) for id_, _ in urls))
+            self.db.execute("COMMIT")
+        return [url for _, url in urls]
+
+    def done(self, urls):
+        now = time.time()
+        with self.lock:
+            self.db.execute("BEGIN")
+            self.db.executemany("UPDATE frontier SET state = ?, last_error = NULL, updated_at = ? WHERE listing_id = ?",
+                                ((DONE, now, listing_id(url)) for url in urls))
+            self.db.execute("COMMIT")
+
+    def fail(self, url, error, permanent=False):
+        """Record a failed attempt; the url is retried later with exponential backoff, or marked failed for good."""
+        now = time.time()
+        with self.lock:
+            attempts = self.db.execute("SELECT attempts FROM frontier WHERE listing_id = ?", (listing_id(url),)).fetchone()
+            attempts = (attempts[0] if attempts else 0) + 1
+            state = FAILED if permanent or attempts >= self.max_attempts else PENDING
+            next_eligible = now + self.retry_base * 2 ** (attempts - 1)
+            self.db.execute("""INSERT INTO frontier (listing_id, url, state, attempts, next_eligible, last_error, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)
+                               ON CONFLICT(listing_id) DO UPDATE SET state = excluded.state, attempts = excluded.attempts,
+                               next_eligible = excluded.next_eligible, last_error = excluded.last_error, updated_at = excluded.updated_at""",
+                            (listing_id(url), url, state, attempts, next_eligible, str(error)[:500], now))
+        return state
+
+    def release(self, urls):
+        """Hand leased urls back without counting an attempt, e.g. when a run stops early."""
+        now = time.time()
+        with self.lock:
+            self.db.execute("BEGIN")
+            self.db.executemany("UPDATE frontier SET state = ?, next_eligible = ?, updated_at = ? WHERE listing_id = ? AND state = ?",
+                                ((PENDING, now, now, listing_id(url), IN_PROGRESS) for url in urls))
+            self.db.execute("COMMIT")
+
+    def counts(self):
+        """Return the number of urls in each state."""
+        with self.lock:
+            return dict(self.db.execute("SELECT state, COUNT(*) FROM frontier GROUP BY state").fetchall())
+
+    def failures(self, limit=20):
+        """Return the most recent failures as (url, state, attempts, last_error) rows."""
+        with self.lock:
+            return self.db.execute("SELECT url, state, attempts, last_error FROM frontier WHERE last_error IS NOT NULL ORDER BY updated_at DESC LIMIT ?",
+                                   (limit,)).fetchall()
@@ -0,0 +1,155 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import requests
+from requests_html import HTMLSession, HTMLResponse
+
+from utils.archive import HtmlArchive
+from utils.metrics import METRICS
+
+# how long a cached page is served without asking hemnet at all, by url pattern (first match wins).
+# search results change with every new sale, so they are always revalidated; a sold listing
+# practically never changes once it is up.
+DEFAULT_TTL_POLICIES = [
+    (r'hemnet\.se/salda/bostader', 0),
+    (r'hemnet\.se/salda/', 30 * 86400),
+]
+
+
+class HttpCache:
+    """On-disk HTTP cache shared by the scraper sessions.
+
+    Response bodies go into the content-addressed HtmlArchive object store, so a listing that is
+    also archived is only stored once. A small SQLite table keeps the url, the ETag/Last-Modified
+    validators and when the page was last confirmed. Within its TTL a page is served from disk
+    without a request; after that it is revalidated with a conditional request, and a 304 is served
+    from disk as well.
+
+    The cache isn't committed. The scrape workflows carry it, with the archive, from one run to the
+    next in the GitHub Actions cache; a run that finds none (the first, or after GitHub evicted it)
+    starts empty and fetches everything.
+    """
+
+    def __init__(self, root='data/http_cache', archive=None, ttl_policies=None, default_ttl=0):
+        self.archive = archive if archive is not None else HtmlArchive()
+        self.ttl_policies = [(re.compile(pattern), ttl) for pattern, ttl in (ttl_policies or DEFAULT_TTL_POLICIES)]
+        self.default_ttl = default_ttl
+        self.stats = {'fresh': 0, 'revalidated': 0, 'miss': 0, 'bytes_saved': 0}
+        self.lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        # parallel shards share the database: WAL lets them read while one writes, and a writer
+        # waits for the lock rather than failing with "database is locked"
+        self.db = sqlite3.connect(os.path.join(root, 'cache.sqlite'), check_same_thread=False, timeout=60)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS entries (
+            url TEXT PRIMARY KEY, sha256 TEXT, etag TEXT, last_modified TEXT, bytes INTEGER, validated_at REAL)""")
+        self.db.commit()
+
+    def ttl_for(self, url):
+        for pattern, ttl in self.ttl_policies:
+            if pattern.search(url):
+                return ttl
+        return self.default_ttl
+
+    def lookup(self, url):
+        """Return the cache entry for `url` as a dict, or None."""
+        with self.lock:
+            row = self.db.execute("SELECT sha256, etag, last_modified, bytes, validated_at FROM entries WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(['sha256', 'etag', 'last_modified', 'bytes', 'validated_at'], row))
+
+    def is_fresh(self, url, entry):
+        return entry is not None and time.time() - entry['validated_at'] < self.ttl_for(url)
+
+    def conditional_headers(self, entry):
+        """Return the If-None-Match/If-Modified-Since headers for revalidating an entry."""
+        headers = {}
+        if entry is not None and entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry is not None and entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def body(self, entry):
+        return self.archive.get(entry['sha256'])
+
+    def hit(self, url, entry, revalidated=False, headers=None):
+        """Record a page served from disk, either fresh or after a 304, and return its body."""
+        self.stats['revalidated' if revalidated else 'fresh'] += 1
+        self.stats['bytes_saved'] += entry['bytes'] or 0
+        METRICS.inc('http_cache_total', result='revalidated' if revalidated else 'fresh')
+        METRICS.inc('http_cache_bytes_saved_total', entry['bytes'] or 0)
+        if revalidated:
+            # a 304 may carry updated validators, and restarts the TTL
+            headers = headers or {}
+            with self.lock:
+                self.db.execute("UPDATE entries SET validated_at = ?, etag = COALESCE(?, etag), last_modified = COALESCE(?, last_modified) WHERE url = ?",
+                                (time.time(), headers.get('ETag'), headers.get('Last-Modified'), url))
+                self.db.commit()
+        return self.body(entry)
+
+    def store(self, url, body, headers):
+        """Record a full 200 response."""
+        self.stats['miss'] += 1
+        METRICS.inc('http_cache_total', result='miss')
+        # without validators or a TTL there is nothing we could ever serve this copy for
+        if self.ttl_for(url) <= 0 and not headers.get('ETag') and not headers.get('Last-Modified'):
+            return
+        digest = self.archive.put_object(body)
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                            (url, digest, headers.get('ETag'), headers.get('Last-Modified'), len(body.encode('utf-8')), time.time()))
+            self.db.commit()
+
+    def summary(self):
+        requests_made = self.stats['revalidated'] + self.stats['miss']
+        served = self.stats['fresh'] + self.stats['revalidated']
+        total = served + self.stats['miss']
+        return (f"HTTP cache: {self.stats['fresh']} fresh, {self.stats['revalidated']} revalidated (304), "
+                f"{self.stats['miss']} misses, {requests_made} requests made, "
+                f"{served / total if total else 0:.0%} served from disk, {self.stats['bytes_saved'] / 1e6:.1f} MB not downloaded")
+
+
+class CachedHTMLSession(HTMLSession):
+    """HTMLSession whose GET requests go through an HttpCache."""
+
+    def __init__(self, cache=None, **kwargs):
+        super().__init__(**kwargs)
+        self.cache = cache if cache is not None else HttpCache()
+
+    def request(self, method, url, *args, **kwargs):
+        if method.upper() != 'GET':
+            return super().request(method, url, *args, **kwargs)
+
+        entry = self.cache.lookup(url)
+        if self.cache.is_fresh(url, entry):
+            try:
+                return self.cached_response(url, self.cache.hit(url, entry))
+            except Exception as e:
+                # the cached body is missing or corrupt, so the page is fetched again without validators
+                print(f"Cached copy of {url} can't be read, fetching it again. Error: {e}")
+                entry = None
+
+        headers = dict(kwargs.pop('headers', None) or {})
+        headers.update(self.cache.conditional_headers(entry))
+        r = super().request(method, url, *args, headers=headers, **kwargs)
+        if r.status_code == 304 and entry is not None:
+            return self.cached_response(url, self.cache.hit(url, entry, revalidated=True, headers=r.headers))
+        if r.status_code == 200:
+            self.cache.store(url, r.text, r.headers)
+        return r
+
+    def cached_response(self, url, body):
+        # build the same kind of response a real request would have given
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response._content = body.encode('utf-8')
+        response.encoding = 'utf-8'
+        response.headers['Content-Type'] = 'text/html; charset=utf-8'
+        response.request = requests.Request('GET', url).prepare()
+        return HTMLResponse._from_response(response, self)
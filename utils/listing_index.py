@@ -0,0 +1,192 @@
+import hashlib
+import math
+import os
+import re
+from urllib.parse import urlsplit
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+# hemnet listing urls end in the listing's numeric id, e.g. .../ormvraksgatan-13-6633634785696377320
+LISTING_ID = r'-(\d+)/?$'
+INT64_MAX = 2 ** 63 - 1
+
+
+def canonical_url(url):
+    """Strip the query string, fragment and trailing slash, and lowercase the host."""
+    parts = urlsplit(url.strip())
+    return f"{parts.scheme}://{parts.netloc.lower()}{parts.path.rstrip('/')}"
+
+
+def _hashed_id(url):
+    # urls without a usable numeric id get a negative id from their hash, so they can never
+    # collide with a real listing id
+    return -int(hashlib.sha1(canonical_url(url).encode('utf-8')).hexdigest()[:15], 16) - 1
+
+
+def listing_id(url):
+    """Return the int64 listing id of a hemnet url."""
+    match = re.search(LISTING_ID, urlsplit(url.strip()).path)
+    if match and int(match.group(1)) <= INT64_MAX:
+        return int(match.group(1))
+    return _hashed_id(url)
+
+
+def listing_ids(urls):
+    """Vectorized listing_id: return an int64 array with the id of every url."""
+    urls = pd.Series(urls, dtype=object).reset_index(drop=True)
+    if urls.empty:
+        return np.empty(0, dtype=np.int64)
+    digits = urls.str.split('?', n=1).str[0].str.split('#', n=1).str[0].str.extract(LISTING_ID)[0]
+    # ids longer than 19 digits can't be int64; those fall back to hashing like urls without an id
+    usable = digits.notna() & ((digits.str.len() < 19) | ((digits.str.len() == 19) & (digits <= str(INT64_MAX))))
+    ids = np.empty(len(urls), dtype=np.int64)
+    ids[usable.to_numpy()] = digits[usable].astype(np.int64).to_numpy()
+    for i in np.flatnonzero(~usable.to_numpy()):
+        ids[i] = _hashed_id(urls[i])
+    return ids
+
+
+def _mix(x):
+    # splitmix64 finaliser, applied to a whole uint64 array at once
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+class BloomFilter:
+    """Bloom filter over int64 ids, with vectorized adds and lookups.
+
+    It never says a known id is missing, and says an unknown id is present with probability
+    about `error_rate` at `capacity` ids.
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(int(capacity), 1)
+        self.capacity = capacity
+        self.bits = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self.array = np.zeros((self.bits + 7) // 8, dtype=np.uint8)
+
+    def positions(self, ids):
+        x = np.asarray(ids, dtype=np.int64).view(np.uint64)
+        # double hashing: the i-th bit is h1 + i * h2
+        with np.errstate(over='ignore'):
+            h1 = _mix(x)
+            h2 = _mix(x ^ np.uint64(0x9E3779B97F4A7C15)) | np.uint64(1)
+            steps = np.arange(self.hashes, dtype=np.uint64)
+            return (h1[:, None] + steps[None, :] * h2[:, None]) % np.uint64(self.bits)
+
+    def add(self, ids):
+        positions = self.positions(ids).ravel()
+        np.bitwise_or.at(self.array, (positions >> np.uint64(3)).astype(np.int64), (np.uint8(1) << (positions & np.uint64(7)).astype(np.uint8)))
+
+    def might_contain(self, ids):
+        positions = self.positions(ids)
+        hit = (self.array[(positions >> np.uint64(3)).astype(np.int64)] >> (positions & np.uint64(7)).astype(np.uint8)) & 1
+        return hit.all(axis=1)
+
+
+class ListingIndex:
+    """Sorted array of every known listing id, stored as a .npy file and memory-mapped on load.
+
+    Membership is checked against a bloom filter first, and only the ids it can't rule out are
+    looked up with a binary search, so checking a page of links costs next to nothing however many
+    millions of ids are known.
+    """
+
+    def __init__(self, ids=None, path=None):
+        self.path = path
+        self.ids = np.unique(np.asarray(ids if ids is not None else [], dtype=np.int64))
+        self.bloom = None
+        self.build_bloom()
+
+    def build_bloom(self):
+        # room to double before the filter gets noticeably worse
+        self.bloom = BloomFilter(max(2 * len(self.ids), 100_000))
+        if len(self.ids):
+            for start in range(0, len(self.ids), 1_000_000):
+                self.bloom.add(self.ids[start:start + 1_000_000])
+
+    @classmethod
+    def from_urls(cls, urls, path=None):
+        return cls(listing_ids(urls), path=path)
+
+    @classmethod
+    def load(cls, path):
+        index = cls(path=path)
+        index.ids = np.load(path, mmap_mode='r')
+        index.build_bloom()
+        return index
+
+    @classmethod
+    def load_or_build(cls, path, links_file):
+        """Load the index of `links_file`, rebuilding it if it is missing or doesn't match the links."""
+        expected = pq.ParquetFile(links_file).metadata.num_rows if os.path.exists(links_file) else 0
+        if os.path.exists(path):
+            index = cls.load(path)
+            if len(index) == expected:
+                return index
+        index = cls(ids_in_parquet(links_file), path=path)
+        index.save()
+        return index
+
+    def __len__(self):
+        return len(self.ids)
+
+    def contains(self, ids):
+        """Return a bool array saying which of `ids` are in the index."""
+        ids = np.asarray(ids, dtype=np.int64)
+        found = np.zeros(len(ids), dtype=bool)
+        if not len(self.ids) or not len(ids):
+            return found
+        maybe = np.flatnonzero(self.bloom.might_contain(ids))
+        if len(maybe):
+            positions = np.searchsorted(self.ids, ids[maybe]).clip(max=len(self.ids) - 1)
+            found[maybe] = self.ids[positions] == ids[maybe]
+        return found
+
+    def __contains__(self, url):
+        return bool(self.contains([listing_id(url)])[0])
+
+    def add(self, ids):
+        """Add ids and return the ones that weren't known yet."""
+        ids = np.unique(np.asarray(ids, dtype=np.int64))
+        new = ids[~self.contains(ids)]
+        if len(new):
+            self.ids = np.union1d(np.asarray(self.ids), new)
+            if len(self.ids) > self.bloom.capacity:
+                self.build_bloom()
+            else:
+                self.bloom.add(new)
+        return new
+
+    def save(self, path=None):
+        path = path or self.path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # np.save appends .npy to names without it, so the temporary file keeps the extension
+        tmp = path[:-len('.npy')] + '.tmp.npy' if path.endswith('.npy') else path + '.tmp.npy'
+        np.save(tmp, np.asarray(self.ids))
+        os.replace(tmp, path)
+
+
+def ids_in_parquet(filename):
+    """Return the listing ids in a Parquet file, from its listing_id column or else its url column."""
+    if not os.path.exists(filename):
+        return np.empty(0, dtype=np.int64)
+    columns = pq.ParquetFile(filename).schema_arrow.names
+    if 'listing_id' in columns:
+        return pq.read_table(filename, columns=['listing_id']).column('listing_id').to_numpy().astype(np.int64)
+    if 'url' in columns:
+        return listing_ids(pq.read_table(filename, columns=['url']).column('url').to_pylist())
+    return np.empty(0, dtype=np.int64)
+
+
+def add_listing_id_column(filename):
+    """Give a links file written before listing ids existed its listing_id column, once."""
+    if not os.path.exists(filename) or 'listing_id' in pq.ParquetFile(filename).schema_arrow.names:
+        return
+    df = pd.read_parquet(filename)
+    df['listing_id'] = listing_ids(df['url'])
+    df.drop_duplicates('listing_id').to_parquet(filename, index=False)
@@ -0,0 +1,149 @@
+import fcntl
+import hashlib
+import json
+import os
+from contextlib import contextmanager
+
+import pandas as pd
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from utils.dataset import load_properties, PROPERTIES_DATASET
+from utils.listing_index import listing_ids
+from utils.schemas import unify_schemas
+
+MANIFEST = 'data/interim/manifest.json'
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def describe_file(path):
+    """Return the manifest entry of one data file: its rows, content hash and listing id range."""
+    entry = {'file': path, 'rows': pq.ParquetFile(path).metadata.num_rows, 'sha256': file_sha256(path),
+             'min_listing_id': None, 'max_listing_id': None}
+    if 'url' in pq.read_schema(path).names and entry['rows']:
+        ids = listing_ids(pq.read_table(path, columns=['url']).column('url').to_pylist())
+        entry['min_listing_id'], entry['max_listing_id'] = int(ids.min()), int(ids.max())
+    return entry
+
+
+class Manifest:
+    """JSON record of every snapshot the scrapers added to the property data, and of how far each
+    downstream stage has got.
+
+    A snapshot is the set of files one run wrote. `kind` is 'append' for new rows, 'compact' when
+    files were merged (the new file `replaces` the old ones and holds no new rows), and 'rebuild'
+    when the whole dataset was rewritten. A stage asks pending() for the files added since its
+    watermark, processes them, and then moves its watermark to the snapshot it read up to. After a
+    rebuild, or on its first run, a stage is told to process everything. So is a stage whose
+    watermark was set by another `version` of its code, whose earlier output is out of date.
+    """
+
+    def __init__(self, path=MANIFEST):
+        self.path = path
+        self.snapshots = []
+        self.watermarks = {}
+        self.reload()
+
+    def reload(self):
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                data = json.load(f)
+            self.snapshots = data.get('snapshots', [])
+            self.watermarks = data.get('watermarks', {})
+
+    @contextmanager
+    def update(self):
+        # shards of the same run record their snapshots at the same time, so every change is made
+        # to the latest manifest on disk, under a lock
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self.reload()
+            yield
+            self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump({'snapshots': self.snapshots, 'watermarks': self.watermarks}, f, indent=2, sort_keys=True)
+        os.replace(self.path + '.tmp', self.path)
+
+    def latest(self):
+        """Return the id of the newest snapshot, 0 if there is none."""
+        return self.snapshots[-1]['id'] if self.snapshots else 0
+
+    def record(self, files, run_id=None, kind='append', replaces=()):
+        """Add a snapshot of `files`, save the manifest, and return the snapshot's id."""
+        entries = [describe_file(f) for f in files]
+        with self.update():
+            snapshot = {
+                'id': self.latest() + 1,
+                'run_id': run_id,
+                'kind': kind,
+                'timestamp': pd.Timestamp.now(tz='UTC').isoformat(),
+                'rows': sum(entry['rows'] for entry in entries),
+                'files': entries,
+                'replaces': list(replaces),
+            }
+            self.snapshots.append(snapshot)
+        return snapshot['id']
+
+    def watermark(self, stage):
+        return self.watermarks.get(stage, {}).get('snapshot', 0)
+
+    def version(self, stage):
+        return self.watermarks.get(stage, {}).get('version')
+
+    def set_watermark(self, stage, snapshot_id, version=None):
+        with self.update():
+            self.watermarks[stage] = {'snapshot': snapshot_id, 'timestamp': pd.Timestamp.now(tz='UTC').isoformat()}
+            if version is not None:
+                self.watermarks[stage]['version'] = version
+
+    def pending(self, stage, version=None):
+        """Return (files, full): the files added after the stage's watermark, or full=True if the
+        stage has to process everything."""
+        mark = self.watermark(stage)
+        newer = [s for s in self.snapshots if s['id'] > mark]
+        if stage not in self.watermarks or any(s['kind'] == 'rebuild' for s in newer):
+            return [], True
+        if version is not None and self.version(stage) != version:
+            return [], True
+        files = []
+        for snapshot in newer:
+            if snapshot['kind'] == 'append':
+                files += [entry['file'] for entry in snapshot['files']]
+            elif snapshot['kind'] == 'compact':
+                # pending files merged into a bigger one are read from that one, together with
+                # rows the stage has already seen; stages are keyed on url, so those are harmless
+                merged = set(snapshot['replaces'])
+                if merged & set(files):
+                    files = [f for f in files if f not in merged] + [entry['file'] for entry in snapshot['files']]
+        files = list(dict.fromkeys(files))
+        if not all(os.path.exists(f) for f in files):
+            # a pending file is gone without a snapshot saying where its rows went (e.g. a
+            # compaction that crashed), so the only safe thing is to process everything
+            return [], True
+        return files, False
+
+    def changes(self, stage, columns=None, root=PROPERTIES_DATASET, version=None):
+        """Return (rows, snapshot id, full): the property rows the stage hasn't processed yet, the
+        snapshot to move its watermark to once they are done, and whether they are all the rows."""
+        snapshot_id = self.latest()
+        files, full = self.pending(stage, version)
+        if full:
+            return load_properties(root, columns=columns), snapshot_id, True
+        if not files:
+            return pd.DataFrame(columns=columns or []), snapshot_id, False
+        schema = unify_schemas([pq.read_schema(f).remove_metadata() for f in files])
+        if columns is not None:
+            columns = [c for c in columns if c in schema.names]
+        rows = ds.dataset(files, schema=schema, format='parquet').to_table(columns=columns).to_pandas()
+        return rows, snapshot_id, False
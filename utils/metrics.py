@@ -0,0 +1,182 @@
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# upper bounds in seconds of the latency histogram buckets, for requests and parsing alike
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30]
+
+# the fields parse_html should find on every listing page; a hit rate that drops to zero means
+# hemnet renamed a CSS class or a label
+EXPECTED_FIELDS = [
+    'Slutpris', 'Title', 'Type', 'Location', 'Sale Date', 'Agent Name',
+    'Boarea', 'Antal rum', 'Byggår', 'Avgift', 'Driftskostnad', 'Utgångspris', 'Pris per kvadratmeter',
+    'Våning', 'Latitude', 'Longitude',
+]
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Estimate a quantile as the upper bound of the bucket it falls in."""
+        if not self.count:
+            return None
+        target, seen = q * self.count, 0
+        for bound, count in zip(self.buckets + [float('inf')], self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float('inf')
+
+    def summary(self):
+        return {'count': self.count, 'sum': round(self.sum, 3), 'mean': round(self.sum / self.count, 4) if self.count else None,
+                'p50': self.quantile(0.5), 'p90': self.quantile(0.9), 'p99': self.quantile(0.99)}
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _label_string(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+class Metrics:
+    """Counters and latency histograms for one scraper run, written out as JSON and as a Prometheus textfile.
+
+    Requests are timed per stage by the session adapter and AsyncFetcher, the scripts time their
+    parsing with timer('parse') and count per-field hits with record_fields().
+    """
+
+    def __init__(self, prefix='hemnet_scraper'):
+        self.prefix = prefix
+        self.started = time.time()
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.counters = {}
+            self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        with self.lock:
+            key = _key(name, labels)
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        with self.lock:
+            key = _key(name, labels)
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('stage_seconds', time.perf_counter() - start, stage=stage)
+
+    def record_request(self, stage, status, latency, size=0):
+        """Count one HTTP request; status is None for a connection error or timeout."""
+        self.observe('request_seconds', latency, stage=stage)
+        self.inc('requests_total', stage=stage, status=str(status) if status is not None else 'error')
+        if size:
+            self.inc('bytes_total', size, stage=stage)
+
+    def record_fields(self, data, fields=EXPECTED_FIELDS):
+        """Count which of the expected fields a parsed listing has."""
+        self.inc('pages_parsed_total')
+        for field in fields:
+            if data.get(field) not in (None, ''):
+                self.inc('field_found_total', field=field)
+
+    def counter(self, name, **labels):
+        return self.counters.get(_key(name, labels), 0)
+
+    def summary(self):
+        elapsed = time.time() - self.started
+        pages = self.counter('pages_parsed_total')
+        summary = {
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+            'elapsed_seconds': round(elapsed, 1),
+            'pages_per_minute': round(pages / (elapsed / 60), 2) if elapsed > 0 else None,
+            'counters': {}, 'histograms': {}, 'field_hit_rates': {},
+        }
+        with self.lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                summary['counters'][name + _label_string(labels)] = value
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                summary['histograms'][name + _label_string(labels)] = histogram.summary()
+        if pages:
+            summary['field_hit_rates'] = {field: round(self.counter('field_found_total', field=field) / pages, 3) for field in EXPECTED_FIELDS}
+        return summary
+
+    def prometheus(self):
+        """Return every metric in the Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            names = sorted({name for name, _ in self.counters})
+            for name in names:
+                lines.append(f'# TYPE {self.prefix}_{name} counter')
+                for (n, labels), value in sorted(self.counters.items()):
+                    if n == name:
+                        lines.append(f'{self.prefix}_{name}{_label_string(labels)} {value}')
+            names = sorted({name for name, _ in self.histograms})
+            for name in names:
+                lines.append(f'# TYPE {self.prefix}_{name} histogram')
+                for (n, labels), histogram in sorted(self.histograms.items()):
+                    if n != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + ['+Inf'], histogram.counts):
+                        cumulative += count
+                        lines.append(f'{self.prefix}_{name}_bucket{_label_string(labels, [("le", bound)])} {cumulative}')
+                    lines.append(f'{self.prefix}_{name}_sum{_label_string(labels)} {histogram.sum}')
+                    lines.append(f'{self.prefix}_{name}_count{_label_string(labels)} {histogram.count}')
+        summary = self.summary()
+        lines.append(f'# TYPE {self.prefix}_pages_per_minute gauge')
+        lines.append(f'{self.prefix}_pages_per_minute {summary["pages_per_minute"] or 0}')
+        lines.append(f'# TYPE {self.prefix}_field_hit_rate gauge')
+        for field, rate in summary['field_hit_rates'].items():
+            lines.append(f'{self.prefix}_field_hit_rate{_label_string([("field", field)])} {rate}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, json_file, prom_file=None):
+        """Write the JSON summary, and the Prometheus textfile if a path is given."""
+        os.makedirs(os.path.dirname(json_file) or '.', exist_ok=True)
+        with open(json_file, 'w', encoding='utf-8') as f:
+            json.dump(self.summary(), f, indent=2, ensure_ascii=False)
+        if prom_file:
+            os.makedirs(os.path.dirname(prom_file) or '.', exist_ok=True)
+            # the node_exporter textfile collector may read at any moment, so never leave a partial file
+            with open(prom_file + '.tmp', 'w', encoding='utf-8') as f:
+                f.write(self.prometheus())
+            os.replace(prom_file + '.tmp', prom_file)
+
+
+# the metrics of the current run, shared by the sessions, fetchers and scripts like FAST_PARSE_STATS
+METRICS = Metrics()
@@ -0,0 +1,177 @@
+import numpy as np
+import pandas as pd
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.pipeline import Pipeline
+
+from utils.values import map_unique, parse_numbers, parse_sale_dates
+
+# The cleaning pipeline of 012-transform-gh-actions-sk-learn.py, which turns the scraped listings
+# into the transformed table. Each step only writes the columns it owns. With copy=False a step
+# assigns them into the frame it is given instead of copying the whole frame first, so the
+# pipeline never holds more than the one frame and the column it is working on.
+
+# bump this whenever a change here changes the transformed values, so the next run transforms every
+# listing again instead of only the new ones
+TRANSFORM_VERSION = 1
+
+# ExtendedCleanNumericTransformer as discussed
+class ExtendedCleanNumericTransformer(BaseEstimator, TransformerMixin):
+    # standard columns that aren't whole numbers: "4,5 rum", and "2019-2021" for a building
+    # finished over several years
+    STANDARD_KINDS = {'Antal rum': 'decimal', 'Byggår': 'year'}
+
+    def __init__(self, standard_columns, area_columns=None, cost_columns=None, copy=True):
+        self.standard_columns = standard_columns
+        self.area_columns = area_columns if area_columns is not None else []
+        self.cost_columns = cost_columns if cost_columns is not None else []
+        self.copy = copy
+
+    def fit(self, X, y=None):
+        return self
+
+    def transform(self, X):
+        if self.copy:
+            X = X.copy()
+        existing_columns = X.columns
+        for column in self.standard_columns + self.area_columns + self.cost_columns:
+            if column in existing_columns:
+                if column in self.standard_columns:
+                    X[column] = parse_numbers(X[column], self.STANDARD_KINDS.get(column, 'amount'))
+                elif column in self.area_columns:
+                    X[column] = parse_numbers(X[column], 'decimal')
+                elif column in self.cost_columns:
+                    X[column] = parse_numbers(X[column], 'amount')
+        return X
+
+# DateTransformer as discussed
+class DateTransformer(BaseEstimator, TransformerMixin):
+    def __init__(self, date_column, copy=True):
+        self.date_column = date_column
+        self.copy = copy
+
+    def fit(self, X, y=None):
+        return self
+
+    def transform(self, X):
+        if self.copy:
+            X = X.copy()
+        # "Såld 12 mars 2024": the few thousand distinct dates are parsed once each, with the
+        # Swedish month names looked up rather than replaced
+        X[self.date_column] = parse_sale_dates(X[self.date_column])
+        X['Sale Year'] = X[self.date_column].dt.year
+        X['Sale Month'] = X[self.date_column].dt.month
+        X['Sale Day'] = X[self.date_column].dt.day
+        return X
+
+# FloorElevatorTransformer as discussed
+class FloorElevatorTransformer(BaseEstimator, TransformerMixin):
+    def __init__(self, column, copy=True):
+        self.column = column
+        self.copy = copy
+
+    def fit(self, X, y=None):
+        return self
+
+    @staticmethod
+    def parse_floors(floors):
+        # "2 av 9, hiss finns": the floor, the top floor ("av" = of) and whether there is a lift
+        elevator = np.select([floors.str.contains('hiss finns ej', regex=False), floors.str.contains('hiss finns', regex=False)],
+                             [0.0, 1.0], default=np.nan)
+        return pd.DataFrame({'Floor Number': floors.str.extract(r'(\d+)')[0].astype(float),
+                             # Add a column called "Top Floor Number" to indicate the top floor number. It is the second number in the range if there is a range separated by "av"
+                             'Top Floor Number': floors.str.extract(r'av (\d+)')[0].astype(float),
+                             'Elevator Presence': elevator})
+
+    def transform(self, X):
+        if self.copy:
+            X = X.copy()
+        parsed = map_unique(X[self.column], self.parse_floors)
+        for column in parsed.columns:
+            X[column] = parsed[column]
+        return X
+    
+# Create a class to code Nej and Ja to 0 and 1 for columns Uteplats and Balkong
+class BinaryTransformer(BaseEstimator, TransformerMixin):
+    def __init__(self, columns, copy=True):
+        self.columns = columns
+        self.copy = copy
+
+    def fit(self, X, y=None):
+        return self
+
+    def transform(self, X):
+        if self.copy:
+            X = X.copy()
+        for column in self.columns:
+            X[column] = X[column].map({'Ja': 1, 'Nej': 0})
+        return X
+    
+# Create a class to rename columns
+class RenameColumnsTransformer(BaseEstimator, TransformerMixin):
+    def __init__(self, column_name_translation, copy=True):
+        self.column_name_translation = column_name_translation
+        self.copy = copy
+
+    def fit(self, X, y=None):
+        return self
+
+    def transform(self, X):
+        if self.copy:
+            return X.rename(columns=self.column_name_translation)
+        X.rename(columns=self.column_name_translation, inplace=True)
+        return X
+
+# Define the column name translations
+column_name_translation = {
+    'Slutpris': 'final_price',
+    'Title': 'title',
+    'Type': 'type',
+    'Location': 'location',
+    'Sale Date': 'sale_date',
+    'Agent Name': 'agent_name',
+    'Agent Link': 'agent_link',
+    'Pris per kvadratmeter': 'price_per_square_meter',
+    'Utgångspris': 'starting_price',
+    'Prisutveckling': 'price_development',
+    'Antal rum': 'number_of_rooms',
+    'Boarea': 'living_area',
+    'Avgift': 'fee',
+    'Driftskostnad': 'operational_cost',
+    'Biarea': 'supplementary_area',
+    'Tomtarea': 'lot_area',
+    'Uteplats': 'outdoor_space',
+    'Arrende': 'leasehold_fee',
+    'Förening': 'housing_association',
+    'Sale Year': 'sale_year',
+    'Sale Month': 'sale_month',
+    'Sale Day': 'sale_day',
+    'Balkong': 'balcony',
+    'Våning': 'floor',
+    'Floor Number': 'floor_number',
+    'Top Floor Number': 'top_floor_number',
+    'Elevator Presence': 'elevator_presence',
+    # Adjusted for columns directly mentioned
+    'Lat': 'latitude',
+    'Long': 'longitude',
+    # Additional translations if necessary
+    'Tomträttsavgäld': 'land_right_fee',
+    'Byggår': 'year_of_construction',
+    'Bostadstyp': 'type_2',
+    'Upplåtelseform': 'ownership_form',
+}
+
+
+def build_pipeline(copy=True):
+    """Return the cleaning pipeline; with copy=False its steps change the frame they are given in place."""
+    return Pipeline([
+        ('extended_clean_numeric', ExtendedCleanNumericTransformer(
+            standard_columns=['Slutpris', 'Utgångspris', 'Pris per kvadratmeter', 'Avgift', 'Driftskostnad', 'Byggår', 'Antal rum'],
+            area_columns=['Biarea', 'Tomtarea', 'Boarea'],
+            cost_columns=['Arrende'],
+            copy=copy,
+        )),
+        ('handle_date', DateTransformer(date_column='Sale Date', copy=copy)),
+        ('floor_elevator', FloorElevatorTransformer(column='Våning', copy=copy)),
+        ('binary_transformer', BinaryTransformer(columns=['Uteplats', 'Balkong'], copy=copy)),
+        ('rename_columns', RenameColumnsTransformer(column_name_translation=column_name_translation, copy=copy)),
+    ])
@@ -0,0 +1,125 @@
+import glob
+import os
+
+import polars as pl
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from utils.dataset import PartitionedDataset, PROPERTIES_DATASET, LEGACY_CACHE
+from utils.schemas import unify_schemas
+
+# Lazy, out-of-core queries over the data directory. Every table is a polars LazyFrame over the
+# files as they are on disk, so a query only reads the columns and row groups it needs, runs on all
+# cores, and streams through the data instead of loading it into pandas first. The aggregates the
+# analysis scripts and the app need are below and return small pandas frames.
+
+DATA_DIRS = ['data/interim', 'data/processed']
+# the per-run files of 011, queried as one table
+RAW_FILES = 'data/raw/*.parquet'
+# the table the analyses and the app are built on
+TRANSFORMED = 'data/processed/hemnet_properties_transformed.parquet'
+
+# the same outlier limits as load_and_preprocess_data
+MIN_PRICE = 100000
+MAX_PRICE = 15000000
+
+
+def tables(data_dirs=DATA_DIRS):
+    """Return {table name: path} for everything that can be queried.
+
+    Every Parquet file in `data_dirs` is a table named after the file. On top of those, 'properties'
+    is the partitioned property dataset and 'raw' is all of data/raw as one table.
+    """
+    found = {}
+    for directory in data_dirs:
+        for path in sorted(glob.glob(os.path.join(directory, '*.parquet'))):
+            found[os.path.splitext(os.path.basename(path))[0]] = path
+    found['properties'] = PROPERTIES_DATASET if PartitionedDataset(PROPERTIES_DATASET).files() else LEGACY_CACHE
+    found['raw'] = RAW_FILES
+    return found
+
+
+def scan(source):
+    """Return a LazyFrame over a table name from tables(), a Parquet, Feather or CSV file, a glob of
+    Parquet files, or a partitioned dataset directory. Nothing is read until the frame is collected."""
+    path = tables().get(source, source)
+    if os.path.isdir(path):
+        dataset = PartitionedDataset(path).to_dataset()
+        if dataset is None:
+            raise FileNotFoundError(f"No data files in {path}")
+        return pl.scan_pyarrow_dataset(dataset)
+    if path.endswith('.csv'):
+        return pl.scan_csv(path, null_values='NA')
+    if path.endswith('.feather'):
+        # e.g. the app's artifact (src/app_data.py), which is uncompressed so polars can memory-map it
+        return pl.scan_ipc(path)
+    files = sorted(glob.glob(path))
+    if not files:
+        raise FileNotFoundError(path)
+    if len(files) == 1:
+        return pl.scan_parquet(files[0])
+    # files written over the years don't all have the same columns, so they are read through one
+    # pyarrow dataset with their unified schema
+    schema = unify_schemas([pq.read_schema(f).remove_metadata() for f in files])
+    return pl.scan_pyarrow_dataset(ds.dataset(files, schema=schema, format='parquet'))
+
+
+def collect(frame):
+    """Run a query with the streaming engine, which processes the data in batches on all cores."""
+    try:
+        return frame.collect(engine='streaming')
+    except TypeError:
+        # polars before 1.0
+        return frame.collect(streaming=True)
+
+
+def _columns(frame):
+    try:
+        return frame.collect_schema().names()
+    except AttributeError:
+        # polars before 1.0
+        return frame.columns
+
+
+def sales(source=TRANSFORMED):
+    """The sales the price analyses use: outliers removed, with the neighbourhood split off the
+    location unless the source already has it."""
+    frame = scan(source).filter((pl.col('final_price') > MIN_PRICE) & (pl.col('final_price') < MAX_PRICE))
+    if 'neighborhood' in _columns(frame):
+        return frame.with_columns(pl.col('neighborhood').cast(pl.Utf8))
+    return frame.with_columns(pl.col('location').cast(pl.Utf8).str.split(',').list.first().str.strip_chars().alias('neighborhood'))
+
+
+def neighborhood_price_stats(source=TRANSFORMED, min_count=100, years=None):
+    """Return the number of sales and the median price of every neighbourhood with at least
+    `min_count` sales, indexed by neighbourhood. `years` is an optional (first, last) range of sale years."""
+    frame = sales(source)
+    if years is not None:
+        frame = frame.filter(pl.col('sale_year').is_between(*years))
+    query = (frame.filter(pl.col('neighborhood').is_not_null())
+             .group_by('neighborhood')
+             .agg(pl.len().alias('count'), pl.col('final_price').median().alias('median'))
+             .filter(pl.col('count') >= min_count))
+    return collect(query).to_pandas().set_index('neighborhood')
+
+
+def top_and_bottom_neighborhoods(source=TRANSFORMED, n=10, min_count=100, years=None):
+    """Return the `n` neighbourhoods with the highest and the `n` with the lowest median price."""
+    stats = neighborhood_price_stats(source, min_count=min_count, years=years)
+    # ties are broken by name, since the groups come back in no particular order
+    return (stats.sort_values(['median', 'neighborhood'], ascending=[False, True]).head(n),
+            stats.sort_values(['median', 'neighborhood']).head(n))
+
+
+def yearly_price_stats(source=TRANSFORMED, neighborhood=None):
+    """Return the median and mean price and the number of sales per sale year, optionally for one neighbourhood."""
+    frame = sales(source)
+    if neighborhood is not None:
+        frame = frame.filter(pl.col('neighborhood') == neighborhood)
+    query = (frame.filter(pl.col('sale_year').is_not_null())
+             .group_by('sale_year')
+             .agg(pl.col('final_price').median().alias('median'),
+                  pl.col('final_price').mean().alias('mean'),
+                  pl.len().alias('count'))
+             .sort('sale_year'))
+    return collect(query).to_pandas()
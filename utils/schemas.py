@@ -0,0 +1,205 @@
+import posixpath
+from fnmatch import fnmatch
+
+import pyarrow as pa
+
+# repeated strings are stored once per row group and read back as pandas categoricals
+DICTIONARY = pa.dictionary(pa.int32(), pa.string())
+
+
+class SchemaError(ValueError):
+    pass
+
+
+def _kind(type_):
+    # the types a column may have on disk and still be read as its declared type
+    if pa.types.is_dictionary(type_):
+        type_ = type_.value_type
+    if pa.types.is_string(type_) or pa.types.is_large_string(type_):
+        return 'string'
+    if pa.types.is_integer(type_) or pa.types.is_floating(type_):
+        return 'number'
+    if pa.types.is_timestamp(type_):
+        return 'timestamp'
+    return str(type_)
+
+
+class Artifact:
+    """Declared schema and Parquet settings of one kind of file the pipeline writes.
+
+    Only the declared columns are typed; any other column is written as it comes, so a field
+    hemnet adds later doesn't break a run. `required` columns must be there on write and on load.
+    """
+
+    def __init__(self, name, fields, required=(), compression='zstd', compression_level=None, row_group_size=10000):
+        self.name = name
+        self.schema = pa.schema(fields)
+        self.required = list(required)
+        self.compression = compression
+        self.compression_level = compression_level
+        # several row groups per file, so filters on load can skip the ones they rule out
+        self.row_group_size = row_group_size
+
+    def to_table(self, df):
+        """Convert a DataFrame to an Arrow table with the declared types, or raise SchemaError."""
+        missing = [c for c in self.required if c not in df.columns]
+        if missing:
+            raise SchemaError(f"{self.name}: missing required columns {missing}")
+        table = pa.Table.from_pandas(df, preserve_index=False).replace_schema_metadata(None)
+        for i, name in enumerate(table.column_names):
+            if name not in self.schema.names:
+                continue
+            type_ = self.schema.field(name).type
+            try:
+                table = table.set_column(i, pa.field(name, type_), table.column(i).cast(type_))
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+                raise SchemaError(f"{self.name}: column {name!r} can't be stored as {type_}: {e}") from e
+        return table
+
+    def check(self, schema, filename=''):
+        """Raise SchemaError if a file's schema lacks a required column or has a declared one with the wrong kind of type."""
+        problems = [f"missing {c!r}" for c in self.required if c not in schema.names]
+        for field in self.schema:
+            if field.name in schema.names:
+                found = schema.field(field.name).type
+                if not pa.types.is_null(found) and _kind(found) != _kind(field.type):
+                    problems.append(f"{field.name!r} is {found}, expected {field.type}")
+        if problems:
+            raise SchemaError(f"{filename or self.name} doesn't match the {self.name} schema: {'; '.join(problems)}")
+
+    def write_options(self):
+        options = {'compression': self.compression, 'row_group_size': self.row_group_size}
+        if self.compression_level is not None:
+            options['compression_level'] = self.compression_level
+        return options
+
+
+ARTIFACTS = {
+    # hemnet_links.parquet: one row per listing url, appended to every week
+    'links': Artifact('links', [
+        ('url', pa.string()),
+        ('listing_id', pa.int64()),
+    ], required=['url'], compression='zstd'),
+    # the scraped listings, exactly as parsed from the page: values like "3 450 000 kr" stay
+    # strings here and are only converted by the transform scripts
+    'properties': Artifact('properties', [
+        ('url', pa.string()),
+        ('Type', DICTIONARY),
+        ('Bostadstyp', DICTIONARY),
+        ('Upplåtelseform', DICTIONARY),
+        ('Antal rum', DICTIONARY),
+        ('Balkong', DICTIONARY),
+        ('Uteplats', DICTIONARY),
+        ('Våning', DICTIONARY),
+        ('Location', DICTIONARY),
+        ('Agent Name', DICTIONARY),
+        ('Agent Link', DICTIONARY),
+        ('Förening', DICTIONARY),
+        ('Latitude', pa.float64()),
+        ('Longitude', pa.float64()),
+    ], required=['url'], compression='zstd', compression_level=6),
+    # output of 012-transform-gh-actions-sk-learn.py, read by the analysis and the app, so it is
+    # compressed for fast decoding rather than size
+    'transformed': Artifact('transformed', [
+        ('final_price', pa.int32()),
+        ('type', DICTIONARY),
+        ('type_2', DICTIONARY),
+        ('ownership_form', DICTIONARY),
+        ('location', DICTIONARY),
+        ('agent_name', DICTIONARY),
+        ('agent_link', DICTIONARY),
+        ('housing_association', DICTIONARY),
+        ('floor', DICTIONARY),
+        ('sale_date', pa.timestamp('ns')),
+        ('price_per_square_meter', pa.float32()),
+        ('starting_price', pa.int32()),
+        ('number_of_rooms', pa.float32()),
+        ('living_area', pa.float32()),
+        ('balcony', pa.int8()),
+        ('outdoor_space', pa.int8()),
+        ('year_of_construction', pa.int16()),
+        ('fee', pa.float32()),
+        ('operational_cost', pa.float32()),
+        ('supplementary_area', pa.float32()),
+        ('lot_area', pa.float32()),
+        ('leasehold_fee', pa.float32()),
+        ('sale_year', pa.int16()),
+        ('sale_month', pa.int8()),
+        ('sale_day', pa.int8()),
+        ('floor_number', pa.float32()),
+        ('top_floor_number', pa.float32()),
+        ('elevator_presence', pa.int8()),
+        # hash of the scraped values the row was transformed from, see storage.row_hashes
+        ('raw_hash', pa.uint64()),
+    ], required=['final_price'], compression='snappy'),
+    # output of 012-transform-gh-actions.py, which leaves some of the area columns as strings
+    'cleaned': Artifact('cleaned', [
+        ('final_price', pa.int32()),
+        ('type', DICTIONARY),
+        ('type_2', DICTIONARY),
+        ('release_form', DICTIONARY),
+        ('location', DICTIONARY),
+        ('agent_name', DICTIONARY),
+        ('agent_link', DICTIONARY),
+        ('housing_association', DICTIONARY),
+        ('floor', DICTIONARY),
+        ('sale_date', pa.timestamp('ns')),
+        ('price_per_square_meter', pa.float32()),
+        ('starting_price', pa.int32()),
+        ('fee', pa.float32()),
+        ('operational_cost', pa.float32()),
+        ('balcony', pa.int8()),
+        ('outdoor_space', pa.int8()),
+        ('sale_year', pa.int16()),
+        ('sale_month', pa.int8()),
+        ('sale_day', pa.int8()),
+        ('floor_number', pa.float32()),
+        ('elevator_presence', pa.int8()),
+        ('supplementary_area_sqm', pa.float32()),
+        ('lot_area_sqm', pa.float32()),
+        ('leasehold_fee_per_year', pa.float32()),
+        ('raw_hash', pa.uint64()),
+    ], required=['final_price'], compression='snappy'),
+    # address_cache.parquet: coordinates stay float64, float32 would move them by up to a metre
+    'geocode': Artifact('geocode', [
+        ('Title', pa.string()),
+        ('Lat', pa.float64()),
+        ('Long', pa.float64()),
+    ], required=['Title'], compression='zstd'),
+}
+
+# which artifact a file is, from its path; the first matching pattern wins
+ARTIFACT_FILES = [
+    ('*data/processed/*cleaned*.parquet', 'cleaned'),
+    ('*data/processed/*.parquet', 'transformed'),
+    ('*hemnet_links*.parquet', 'links'),
+    ('*address_cache*.parquet', 'geocode'),
+    ('*hemnet_properties*.parquet', 'properties'),
+    ('*properties/sale_year=*/*.parquet', 'properties'),
+]
+
+
+def artifact_for(filename):
+    """Return the Artifact a file is written as, or None for files without a declared schema."""
+    path = posixpath.normpath(str(filename).replace('\\', '/'))
+    for pattern, name in ARTIFACT_FILES:
+        if fnmatch(path, pattern):
+            return ARTIFACTS[name]
+    return None
+
+
+def resolve_artifact(artifact, filename):
+    """Return the Artifact for an `artifact` argument: an Artifact, a name from ARTIFACTS, or None to go by the filename."""
+    if artifact is None:
+        return artifact_for(filename)
+    if isinstance(artifact, str):
+        return ARTIFACTS[artifact]
+    return artifact
+
+
+def unify_schemas(schemas):
+    """pa.unify_schemas, also for files that store a column as plain strings and others as a dictionary."""
+    dictionaries = {field.name: field.type for schema in schemas for field in schema if pa.types.is_dictionary(field.type)}
+    schemas = [pa.schema([pa.field(field.name, dictionaries[field.name]) if field.name in dictionaries and _kind(field.type) == 'string' else field
+                          for field in schema]) for schema in schemas]
+    return pa.unify_schemas(schemas, promote_options='permissive')
@@ -1,11 +1,17 @@
 import requests
 from bs4 import BeautifulSoup
-from requests_html import HTMLSession
 from math import ceil
 import re
-import random
-import time
 import json
+import lxml.html
+
+from utils.listing_index import listing_id
+from utils.session import make_session
+
+# the hemnet host that relative listing links are joined onto
+HEMNET_URL = 'https://www.hemnet.se'
+# number of listings shown on each search results page
+RESULTS_PER_PAGE = 50
 
 
 # function to get the HTML content from a page
@@ -27,6 +33,79 @@ def extract_coordinates_from_request(request_body):
         return (float(lat), float(lng))
     return None
 
+# rough bounding box of Sweden, used to reject coordinates that can't belong to a listing
+SWEDEN_LAT = (55.0, 69.1)
+SWEDEN_LNG = (10.9, 24.2)
+
+# the key pairs hemnet's page state and schema.org data use for coordinates
+COORDINATE_KEYS = [('lat', 'long'), ('lat', 'lng'), ('latitude', 'longitude')]
+
+def _coordinates_in(value):
+    # walk the page state depth first and return the first plausible lat/long pair
+    if isinstance(value, dict):
+        for lat_key, lng_key in COORDINATE_KEYS:
+            if lat_key in value and lng_key in value:
+                try:
+                    lat, lng = float(value[lat_key]), float(value[lng_key])
+                except (TypeError, ValueError):
+                    continue
+                if SWEDEN_LAT[0] <= lat <= SWEDEN_LAT[1] and SWEDEN_LNG[0] <= lng <= SWEDEN_LNG[1]:
+                    return (lat, lng)
+        children = value.values()
+    elif isinstance(value, list):
+        children = value
+    else:
+        return None
+    for child in children:
+        coordinates = _coordinates_in(child)
+        if coordinates:
+            return coordinates
+    return None
+
+def _keyed_objects(value):
+    # yield every (key, value) pair in the page state
+    if isinstance(value, dict):
+        for key, child in value.items():
+            yield key, child
+            yield from _keyed_objects(child)
+    elif isinstance(value, list):
+        for child in value:
+            yield from _keyed_objects(child)
+
+# function to extract coordinates from the page state embedded in the listing HTML, so no browser is needed
+def extract_coordinates_from_html(html_content, url=None):
+    tree = lxml.html.fromstring(html_content)
+
+    # the Next.js page state holds the listing, keyed by e.g. "SoldPropertyListing:<listing id>".
+    # the page also embeds other listings (similar sales etc.), so with a url only the listing's own
+    # object is used; the first coordinates anywhere in the state are often another listing's
+    for script in tree.xpath('//script[@id="__NEXT_DATA__"]'):
+        try:
+            state = json.loads(script.text or '')
+        except ValueError:
+            continue
+        if url:
+            suffix = f':{listing_id(url)}'
+            for key, value in _keyed_objects(state):
+                if key.endswith(suffix):
+                    coordinates = _coordinates_in(value)
+                    if coordinates:
+                        return coordinates
+        else:
+            coordinates = _coordinates_in(state)
+            if coordinates:
+                return coordinates
+
+    # schema.org data, e.g. {"@type": "GeoCoordinates", "latitude": ..., "longitude": ...}
+    for script in tree.xpath('//script[@type="application/ld+json"]'):
+        try:
+            coordinates = _coordinates_in(json.loads(script.text or ''))
+        except ValueError:
+            continue
+        if coordinates:
+            return coordinates
+    return None
+
 # function to parse the HTML content of a partcular property
 def parse_html(html_content, session=None, url=None):
     soup = BeautifulSoup(html_content, 'html.parser')
@@ -146,6 +225,46 @@ def parse_html(html_content, session=None, url=None):
     return data
 
 
+# function to build a search page url for a living area range and page number
+def search_url(base_url, min_area=None, max_area=None, page=None):
+    url = base_url
+    if min_area is not None and max_area is not None:
+        url = f"{url}&living_area_min={min_area}&living_area_max={max_area}"
+    if page is not None:
+        url = f"{url}&page={page}"
+    return url
+
+# function to split the living area into the ranges walked by collect_property_links
+def area_ranges(min_area, max_area, step):
+    ranges = []
+    current_min_area = min_area
+    while current_min_area <= max_area:
+        current_max_area = current_min_area + step if current_min_area < 160 else current_min_area + 10
+        ranges.append((current_min_area, current_max_area))
+        current_min_area = current_max_area + 1
+    return ranges
+
+# function to extract the property links from the HTML of a search page
+def extract_property_links(html_content):
+    tree = lxml.html.fromstring(html_content)
+    links = tree.cssselect('div[data-testid="result-list"] a.hcl-card')
+    return [HEMNET_URL + link.get('href') for link in links if link.get('href') is not None]
+
+# function to extract the total number of results from the pagination div of a search page
+def extract_total_results(html_content):
+    tree = lxml.html.fromstring(html_content)
+    pagination = tree.cssselect('.hcl-pagination')
+    if not pagination:
+        return None
+    # join the text nodes with newlines so the page buttons after the count don't run into it
+    pagination_text = '\n'.join(pagination[0].itertext())
+    # counts above 999 are written with a (non-breaking) space as thousands separator, e.g. "av 2 345"
+    total_results_match = re.search(r'av\s+(\d[\d \xa0]*)', pagination_text)
+    if total_results_match:
+        return int(re.sub(r'\D', '', total_results_match.group(1)))
+    return None
+
+
 # function to get the total pages
 def get_total_pages(session, base_url, min_area, max_area):
     url = f"{base_url}&living_area_min={min_area}&living_area_max={max_area}"
@@ -153,25 +272,21 @@ def get_total_pages(session, base_url, min_area, max_area):
         r = session.get(url)
         # r.html.render()  # Uncomment if JavaScript needs to run to load the pagination information
         
-        # Find the total number of results from the pagination div
-        pagination_text = r.html.find('.hcl-pagination', first=True).text
-        
-        # Use regex to extract the total number of results
-        total_results_match = re.search(r'av\s+(\d+)', pagination_text)
-        if total_results_match:
-            total_results = int(total_results_match.group(1))  # Convert the captured number to an integer
-        else:
+        # the same count the async crawler reads, thousands separators included
+        total_results = extract_total_results(r.text)
+        if total_results is None:
             print("Warning: Could not find total results in pagination text for URL:", url)
             return 0  # Return 0 if we can't find the total results
         
-        total_pages = ceil(total_results / 50)  # Assuming 50 results per page
+        total_pages = ceil(total_results / RESULTS_PER_PAGE)
         return total_pages
     except Exception as e:
         print(f"Error fetching total pages for URL: {url}. Error: {e}")
         return 0  # Return 0 to handle errors gracefully
 
-def collect_property_links(base_url, min_area, max_area, step):
-    session = HTMLSession()
+def collect_property_links(base_url, min_area, max_area, step, session=None):
+    # pass make_session('search', cache=...) to serve unchanged pages from the HTTP cache
+    session = session if session is not None else make_session('search')
     property_links = []
     
     current_min_area = min_area
@@ -197,8 +312,6 @@ def collect_property_links(base_url, min_area, max_area, step):
                 
                 # Optional: Print out the progress
                 print(f"Collected links from page {page} for size range {current_min_area}-{current_max_area}")
-                # sleep for a random time between 1 and 3 seconds
-                time.sleep(random.uniform(1, 3))
             except Exception as e:
                 print(f"Error collecting links from page {page} for size range {current_min_area}-{current_max_area}. Error: {e}")
                 # Continue to the next page even if the current one fails
@@ -209,8 +322,8 @@ def collect_property_links(base_url, min_area, max_area, step):
     return property_links
 
 
-def collect_property_links_gh_actions(base_url):
-    session = HTMLSession()
+def collect_property_links_gh_actions(base_url, session=None):
+    session = session if session is not None else make_session('search')
     property_links = []
 
     total_pages = 10 # Assume 10 pages for demonstration purposes
@@ -227,8 +340,6 @@ def collect_property_links_gh_actions(base_url):
             
             # Optional: Print out the progress
             print(f"Collected links from page {page}")
-            # sleep for a random time between 1 and 3 seconds
-            time.sleep(random.uniform(1, 3))
         except Exception as e:
             print(f"Error collecting links from page {page}. Error: {e}")
             # Continue to the next page even if the current one fails
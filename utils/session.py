@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+
+from requests.adapters import HTTPAdapter
+from requests_html import HTMLSession
+
+from utils.http_cache import CachedHTMLSession
+from utils.metrics import METRICS
+
+# statuses that mean "slow down" or "try again later" rather than "this page is broken"
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+# starting, lowest and highest request rates (requests per second) for each kind of page. The
+# starting rates match the old fixed sleeps of 1-3 s for search pages and 5-10 s for listings.
+PROFILES = {
+    'search': {'initial_qps': 0.5, 'min_qps': 0.1, 'max_qps': 2.0},
+    'listing': {'initial_qps': 0.15, 'min_qps': 0.03, 'max_qps': 1.0},
+}
+
+
+class CircuitOpenError(Exception):
+    """Raised when the circuit breaker has tripped too many times and the run should stop."""
+
+
+class RateController:
+    """AIMD request pacing: the rate creeps up while responses are fast and healthy, and is halved on 429/5xx or errors."""
+
+    def __init__(self, initial_qps=0.5, min_qps=0.1, max_qps=2.0, increase=0.05, decrease=0.5, latency_target=2.0):
+        self.qps = initial_qps
+        self.min_qps = min_qps
+        self.max_qps = max_qps
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_target = latency_target
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        # hand out evenly spaced slots, so concurrent callers can't all go at once
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            # a little jitter keeps the requests from looking machine-timed
+            self.next_slot = slot + random.uniform(0.8, 1.2) / self.qps
+            return slot - now
+
+    def wait(self):
+        time.sleep(self.reserve())
+
+    async def wait_async(self):
+        await asyncio.sleep(self.reserve())
+
+    def record(self, status, latency):
+        """Adapt the rate to the outcome of a request; status is None for a connection error or timeout."""
+        with self.lock:
+            if status is None or status in RETRYABLE_STATUSES:
+                self.qps = max(self.min_qps, self.qps * self.decrease)
+            elif latency <= self.latency_target:
+                self.qps = min(self.max_qps, self.qps + self.increase)
+
+
+class CircuitBreaker:
+    """Pause the run after `threshold` failures in a row, and give up after `max_trips` pauses.
+
+    After a pause one request is let through; if it fails too the breaker trips again straight
+    away, with twice the cooldown.
+    """
+
+    def __init__(self, threshold=5, cooldown=60, max_trips=3):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_trips = max_trips
+        self.failures = 0
+        self.trips = 0
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def pause(self):
+        """Return how long to wait before the next request, raising CircuitOpenError once the breaker has given up."""
+        with self.lock:
+            if self.trips > self.max_trips:
+                raise CircuitOpenError(f"Circuit breaker tripped {self.trips} times, giving up")
+            return max(0, self.paused_until - time.monotonic())
+
+    def record(self, success):
+        with self.lock:
+            if success:
+                self.failures = 0
+                self.trips = 0
+                return
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.trips += 1
+                cooldown = self.cooldown * 2 ** (self.trips - 1)
+                self.paused_until = time.monotonic() + cooldown
+                # one more failure after the pause trips the breaker again
+                self.failures = self.threshold - 1
+                logging.warning(f"{self.threshold} failed requests in a row, pausing for {cooldown:.0f}s (trip {self.trips})")
+
+
+def retry_delay(attempt, retry_after=None, base=1.0, cap=60.0):
+    """Exponential backoff with full jitter, unless the server said how long to wait."""
+    if retry_after is not None:
+        try:
+            return min(cap, float(retry_after))
+        except ValueError:
+            pass
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class ControlledAdapter(HTTPAdapter):
+    """requests transport adapter that paces, retries and circuit-breaks every request it sends.
+
+    It sits below the session, so pages served from the HTTP cache never reach it. Every attempt
+    is recorded in METRICS under `stage`.
+    """
+
+    def __init__(self, controller, breaker, max_retries=3, stage='search', **kwargs):
+        super().__init__(**kwargs)
+        self.controller = controller
+        self.breaker = breaker
+        self.retries = max_retries
+        self.stage = stage
+
+    def send(self, request, **kwargs):
+        for attempt in range(self.retries + 1):
+            time.sleep(self.breaker.pause())
+            self.controller.wait()
+            start = time.monotonic()
+            try:
+                response = super().send(request, **kwargs)
+            except Exception as e:
+                self.controller.record(None, time.monotonic() - start)
+                METRICS.record_request(self.stage, None, time.monotonic() - start)
+                self.breaker.record(False)
+                if attempt == self.retries:
+                    raise
+                logging.warning(f"Request to {request.url} failed ({e}), retrying")
+                time.sleep(retry_delay(attempt))
+                continue
+
+            # read the body here, so the latency covers the whole download
+            size = int(response.headers.get('Content-Length') or 0) if kwargs.get('stream') else len(response.content)
+            latency = time.monotonic() - start
+            self.controller.record(response.status_code, latency)
+            METRICS.record_request(self.stage, response.status_code, latency, size)
+            if response.status_code not in RETRYABLE_STATUSES:
+                self.breaker.record(True)
+                return response
+            self.breaker.record(False)
+            if attempt == self.retries:
+                return response
+            logging.warning(f"Got {response.status_code} from {request.url}, retrying")
+            time.sleep(retry_delay(attempt, response.headers.get('Retry-After')))
+
+
+def make_controls(kind='search'):
+    """Return a fresh (RateController, CircuitBreaker) pair for one kind of page."""
+    return RateController(**PROFILES[kind]), CircuitBreaker()
+
+
+def make_session(kind='search', cache=None, max_retries=3):
+    """Create the HTMLSession every scraper uses, paced for `kind` ('search' or 'listing') pages.
+
+    With a cache, unchanged pages are served by the HttpCache without going through the
+    rate controller at all.
+    """
+    session = CachedHTMLSession(cache=cache) if cache is not None else HTMLSession()
+    session.controller, session.breaker = make_controls(kind)
+    adapter = ControlledAdapter(session.controller, session.breaker, max_retries=max_retries, stage=kind)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
@@ -0,0 +1,103 @@
+import argparse
+import glob
+import hashlib
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from utils.scraper import HEMNET_URL
+from utils.storage import load_parquet, append_to_parquet, save_to_parquet
+from utils.listing_index import listing_ids, ids_in_parquet, add_listing_id_column
+
+# Malmö, the location every scraper was originally written for
+DEFAULT_LOCATION_IDS = [17989]
+
+
+def location_url(location_id):
+    """Return the sold-listings search url for one hemnet location id."""
+    return f"{HEMNET_URL}/salda/bostader?location_ids%5B%5D={location_id}"
+
+
+def shard_of(key, num_shards):
+    """Return the shard a key belongs to. Stable across runs, processes and machines, unlike hash()."""
+    if num_shards <= 1:
+        return 0
+    return int(hashlib.sha1(str(key).encode('utf-8')).hexdigest()[:8], 16) % num_shards
+
+
+def work_units(location_ids, min_area, max_area, step):
+    """Split the crawl into (location_id, min_area, max_area) units that can be spread over shards."""
+    units = []
+    for location_id in location_ids:
+        low = min_area
+        while low <= max_area:
+            units.append((location_id, low, min(low + step - 1, max_area)))
+            low += step
+    return units
+
+
+def units_for_shard(units, shard, num_shards):
+    return [unit for unit in units if shard_of(unit, num_shards) == shard]
+
+
+def shard_path(path, shard, num_shards):
+    """Return the per-shard version of an output path, e.g. hemnet_links.shard-1-of-4.parquet; unsharded runs keep the path."""
+    if num_shards <= 1:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard-{shard}-of-{num_shards}{ext}"
+
+
+def shard_files(path):
+    """Return the per-shard files written for `path`, whatever number of shards they came from."""
+    root, ext = os.path.splitext(path)
+    pattern = re.compile(re.escape(root) + r'\.shard-\d+-of-\d+' + re.escape(ext) + '$')
+    return sorted(f for f in glob.glob(f"{root}.shard-*{ext}") if pattern.match(f))
+
+
+def merge_shards(path, remove=True):
+    """Merge every shard file of `path` into `path`, skipping listings that are already there.
+
+    Returns the number of rows added. The merged file is appended to as new row groups, so merging
+    a few shards into a large cache doesn't rewrite it through pandas.
+    """
+    files = shard_files(path)
+    if not files:
+        return 0
+    df = pd.concat([load_parquet(f) for f in files], ignore_index=True)
+    if 'url' in df.columns:
+        # listings are matched on their int64 id, from the listing_id column or else the url
+        if 'listing_id' in df.columns:
+            add_listing_id_column(path)
+        ids = df['listing_id'].to_numpy() if 'listing_id' in df.columns else listing_ids(df['url'])
+        keep = ~pd.Series(ids).duplicated(keep='last').to_numpy() & ~np.isin(ids, ids_in_parquet(path))
+        df = df[keep]
+    if not df.empty:
+        if os.path.exists(path):
+            append_to_parquet(df, path)
+        else:
+            save_to_parquet(df, path)
+    if remove:
+        for f in files:
+            os.remove(f)
+    return len(df)
+
+
+def add_shard_arguments(parser):
+    """Add the --locations/--shard/--num-shards options shared by the sharded scripts.
+
+    The SHARD_INDEX and SHARD_COUNT environment variables are the defaults, so a CI matrix can set them.
+    """
+    parser.add_argument('--locations', type=int, nargs='+', default=DEFAULT_LOCATION_IDS, help="hemnet location ids to crawl")
+    parser.add_argument('--shard', type=int, default=int(os.environ.get('SHARD_INDEX', 0)), help="index of this worker's shard")
+    parser.add_argument('--num-shards', type=int, default=int(os.environ.get('SHARD_COUNT', 1)), help="number of workers sharing the crawl")
+    return parser
+
+
+def parse_shard_arguments(description):
+    args = add_shard_arguments(argparse.ArgumentParser(description=description)).parse_args()
+    if not 0 <= args.shard < args.num_shards:
+        raise ValueError(f"--shard must be between 0 and {args.num_shards - 1}, got {args.shard}")
+    return args
@@ -0,0 +1,193 @@
+import asyncio
+import glob
+import hashlib
+import os
+import random
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+
+from aiohttp import web
+
+from utils.archive import HtmlArchive
+from utils.fast_parser import parse_html_fast
+from utils.scraper import RESULTS_PER_PAGE
+
+# hemnet never shows more than this many search result pages for one query
+MAX_PAGES = 50
+
+SEARCH_PAGE = """<html><head><title>Slutpriser</title></head><body>
+<div data-testid="result-list">
+{cards}
+</div>
+<nav class="hcl-pagination"><span>Visar {first}–{last} av {total}</span>
+{buttons}
+</nav>
+</body></html>"""
+
+CARD = '<a class="hcl-card" href="{path}"><h2 class="hcl-card__title">{title}</h2></a>'
+
+
+def _living_area(html_content, path):
+    # search results are filtered on living area, so each listing needs one; take it from the page
+    # if it has one, otherwise derive a stable one from the path
+    area = parse_html_fast(html_content).get('Boarea', '')
+    match = re.search(r'\d+', area.replace('\xa0', '').replace(' ', ''))
+    if match:
+        return int(match.group())
+    return 20 + int(hashlib.sha256(path.encode()).hexdigest(), 16) % 200
+
+
+class StandinServer:
+    """Local stand-in for hemnet.se, for testing and benchmarking the scrapers without touching the real site.
+
+    Listing pages are replayed from a corpus of recorded pages, each served under its own path.
+    Search pages for /salda/bostader are generated from those listings. They honour
+    living_area_min/max and page, paginate RESULTS_PER_PAGE at a time and stop at MAX_PAGES, just
+    like hemnet. Every response can be delayed by `latency` seconds (a (low, high) range). A share
+    of them fail with a 503 (`error_rate`) or a 429 (`throttle_rate`). With `max_qps`, requests
+    above that rate get a 429 with Retry-After, the way hemnet pushes back.
+    Listing pages carry an ETag and answer If-None-Match with a 304.
+    """
+
+    def __init__(self, pages, latency=(0.0, 0.0), error_rate=0.0, throttle_rate=0.0, max_qps=None, seed=0, port=0):
+        self.pages = pages
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.max_qps = max_qps
+        self.random = random.Random(seed)
+        self.port = port
+        self.areas = {path: _living_area(html_content, path) for path, html_content in pages.items()}
+        self.etags = {path: '"' + hashlib.sha256(html_content.encode('utf-8')).hexdigest()[:16] + '"' for path, html_content in pages.items()}
+        self.ordered = sorted(pages)
+        self.stats = {'requests': 0, 'bytes': 0, 'statuses': {}, 'latencies': []}
+        self.recent = []
+        self.loop = None
+        self.thread = None
+
+    @classmethod
+    def from_corpus(cls, corpus_dir='data/html/listings', **kwargs):
+        """Serve the listing pages saved by bench-parse-html.py record, named <listing id>.html."""
+        pages = {}
+        for path in sorted(glob.glob(os.path.join(corpus_dir, '*.html'))):
+            listing_id = os.path.splitext(os.path.basename(path))[0]
+            with open(path, encoding='utf-8') as f:
+                pages[f'/salda/lagenhet-{listing_id}'] = f.read()
+        return cls(pages, **kwargs)
+
+    @classmethod
+    def from_archive(cls, archive_root='data/html/archive', limit=None, **kwargs):
+        """Serve the latest archived copy of each listing under its original path."""
+        archive = HtmlArchive(archive_root)
+        latest = archive.latest()
+        if limit:
+            latest = latest.head(limit)
+        pages = {urlsplit(url).path: archive.get(digest) for url, digest in zip(latest['url'], latest['sha256'])}
+        return cls(pages, **kwargs)
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.port}'
+
+    def search_url(self):
+        return self.url + '/salda/bostader?location_ids%5B%5D=17989'
+
+    def local_url(self, url):
+        """Map a collected hemnet.se listing url onto this server."""
+        parts = urlsplit(url)
+        return self.url + parts.path
+
+    def search_page(self, query):
+        low = int(query.get('living_area_min', 0))
+        high = int(query.get('living_area_max', 10 ** 6))
+        page = int(query.get('page', 1))
+        matches = [path for path in self.ordered if low <= self.areas[path] <= high]
+        results = matches[(page - 1) * RESULTS_PER_PAGE:page * RESULTS_PER_PAGE] if page <= MAX_PAGES else []
+        cards = '\n'.join(CARD.format(path=path, title=path.rsplit('/', 1)[-1]) for path in results)
+        first = (page - 1) * RESULTS_PER_PAGE + 1 if results else 0
+        total_pages = min(MAX_PAGES, -(-len(matches) // RESULTS_PER_PAGE))
+        buttons = ' '.join(f'<a href="?page={p}">{p}</a>' for p in range(1, min(total_pages, 5) + 1))
+        # hemnet writes counts above 999 with a non-breaking space as the thousands separator
+        total = f'{len(matches):,}'.replace(',', '\xa0')
+        return SEARCH_PAGE.format(cards=cards, first=first, last=first + len(results) - 1 if results else 0, total=total, buttons=buttons)
+
+    def throttled(self):
+        if self.max_qps is None:
+            return False
+        now = time.monotonic()
+        self.recent = [t for t in self.recent if now - t < 1.0]
+        if len(self.recent) >= self.max_qps:
+            return True
+        self.recent.append(now)
+        return False
+
+    async def handle(self, request):
+        start = time.monotonic()
+        await asyncio.sleep(self.random.uniform(*self.latency))
+        response = self.respond(request)
+        self.stats['requests'] += 1
+        self.stats['statuses'][response.status] = self.stats['statuses'].get(response.status, 0) + 1
+        self.stats['bytes'] += len(response.body or b'')
+        self.stats['latencies'].append(time.monotonic() - start)
+        return response
+
+    def respond(self, request):
+        if self.throttled() or self.random.random() < self.throttle_rate:
+            return web.Response(status=429, headers={'Retry-After': '1'})
+        if self.random.random() < self.error_rate:
+            return web.Response(status=503)
+        if request.path == '/salda/bostader':
+            return web.Response(text=self.search_page(request.query), content_type='text/html')
+        if request.path not in self.pages:
+            return web.Response(status=404)
+        etag = self.etags[request.path]
+        if request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304, headers={'ETag': etag})
+        return web.Response(text=self.pages[request.path], content_type='text/html', headers={'ETag': etag})
+
+    def start(self, timeout=10):
+        """Start serving in a background thread and return the base url.
+
+        Raises RuntimeError if the server isn't up within `timeout` seconds, e.g. because the
+        port is taken and the thread died before it could signal.
+        """
+        ready = threading.Event()
+
+        def serve():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            app = web.Application()
+            app.router.add_get('/{tail:.*}', self.handle)
+            self.runner = web.AppRunner(app, access_log=None)
+            self.loop.run_until_complete(self.runner.setup())
+            site = web.TCPSite(self.runner, '127.0.0.1', self.port)
+            self.loop.run_until_complete(site.start())
+            # with port 0 the OS picks a free port
+            self.port = site._server.sockets[0].getsockname()[1]
+            ready.set()
+            self.loop.run_forever()
+            self.loop.run_until_complete(self.runner.cleanup())
+
+        self.thread = threading.Thread(target=serve, daemon=True)
+        self.thread.start()
+        if not ready.wait(timeout):
+            raise RuntimeError(f"stand-in server didn't start on port {self.port} within {timeout}s")
+        return self.url
+
+    def stop(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop = None
+
+    def reset_stats(self):
+        self.stats = {'requests': 0, 'bytes': 0, 'statuses': {}, 'latencies': []}
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
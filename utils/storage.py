@@ -1,12 +1,216 @@
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import json
 import os
 
-def save_to_parquet(df, filename):
-    df.to_parquet(filename, index=False)
+from utils.listing_index import listing_ids, ids_in_parquet
+from utils.schemas import resolve_artifact, unify_schemas
 
-def load_parquet(filename):
-    """Load a Parquet file into a DataFrame."""
+def save_to_parquet(df, filename, artifact=None):
+    """Save a DataFrame with the declared schema and codec of its artifact (see utils/schemas.py).
+
+    The artifact is found from the filename unless given; files without one are written as they are.
+    """
+    artifact = resolve_artifact(artifact, filename)
+    if artifact is None:
+        df.to_parquet(filename, index=False)
+        return
+    pq.write_table(artifact.to_table(df), filename, **artifact.write_options())
+
+def load_parquet(filename, columns=None, filters=None, artifact=None):
+    """Load a Parquet file into a DataFrame, raising SchemaError first if it doesn't match its artifact's schema.
+
+    Only `columns` are read, and `filters` (pyarrow filters, e.g. [('sale_year', '>=', 2023)]) skip
+    the row groups whose statistics rule them out before anything is decoded.
+    """
     if os.path.exists(filename):
-        return pd.read_parquet(filename)
+        artifact = resolve_artifact(artifact, filename)
+        if artifact is not None:
+            artifact.check(pq.read_schema(filename), filename)
+        return pd.read_parquet(filename, columns=columns, filters=filters)
     else:
-        return pd.DataFrame()
\ No newline at end of file
+        return pd.DataFrame(columns=columns or [])
+
+def parquet_columns(filename):
+    """Return the column names of a Parquet file from its footer, or [] if there is no such file."""
+    return pq.read_schema(filename).names if os.path.exists(filename) else []
+
+
+def conform_table(table, schema):
+    # give a table every column of the schema, in the schema's order and types
+    columns = [table.column(field.name).cast(field.type) if field.name in table.column_names else pa.nulls(len(table), field.type)
+               for field in schema]
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+def append_to_parquet(df, filename, row_group_size=10000, artifact=None):
+    """Append rows to a Parquet file as new row groups.
+
+    Parquet files can't be appended to in place, so the existing row groups are streamed one at a
+    time into a new file that replaces the old one, and the existing rows are never all in memory.
+    New columns are added to the schema, with nulls for the rows that came before them.
+
+    Every append copies the whole file, so it costs as much as the file, not the rows added. Data
+    that grows every run belongs in a PartitionedDataset (utils/dataset.py), which writes new rows
+    as new files.
+    """
+    artifact = resolve_artifact(artifact, filename)
+    new = artifact.to_table(df) if artifact is not None else pa.Table.from_pandas(df, preserve_index=False).replace_schema_metadata(None)
+    options = artifact.write_options() if artifact is not None else {}
+    options.pop('row_group_size', None)
+    if not os.path.exists(filename):
+        pq.write_table(new, filename, row_group_size=row_group_size, **options)
+        return
+
+    existing = pq.ParquetFile(filename)
+    try:
+        schema = unify_schemas([existing.schema_arrow.remove_metadata(), new.schema])
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # a column changed type in a way arrow can't promote; let pandas sort it out
+        save_to_parquet(pd.concat([load_parquet(filename), df], ignore_index=True), filename, artifact)
+        return
+
+    tmp = filename + '.tmp'
+    with pq.ParquetWriter(tmp, schema, **options) as writer:
+        for i in range(existing.num_row_groups):
+            writer.write_table(conform_table(existing.read_row_group(i), schema))
+        writer.write_table(conform_table(new, schema), row_group_size=row_group_size)
+    # only replace the old file once the new one is complete
+    os.replace(tmp, filename)
+
+
+def row_hashes(df, columns):
+    """Return a uint64 hash of every row's values in `columns`, so a later copy of a row can be
+    told apart from an unchanged one.
+
+    Columns the frame doesn't have count as empty, and so do columns with no values at all, which
+    pandas reads as float NaN or as strings depending on the file.
+    """
+    values = {}
+    for column in columns:
+        series = df[column] if column in df.columns else None
+        if series is None or (pd.api.types.is_numeric_dtype(series.dtype) and series.isna().all()):
+            series = pd.Series(None, index=df.index, dtype=object)
+        values[column] = series
+    return pd.util.hash_pandas_object(pd.DataFrame(values, index=df.index), index=False).to_numpy()
+
+
+def upsert_parquet(df, filename, key='url', sort_by=None, artifact=None):
+    """Add rows to a Parquet file, replacing the rows that have the same `key`.
+
+    New keys only are appended as new row groups; if any key is already in the file, the file is
+    rewritten without its old rows, sorted by `sort_by` if given. Either way the whole file is
+    rewritten (see append_to_parquet), so an upsert costs as much as the file, not the rows added.
+    """
+    if not os.path.exists(filename) or not load_parquet(filename, columns=[key])[key].isin(df[key]).any():
+        append_to_parquet(df, filename, artifact=artifact)
+        return
+    existing = load_parquet(filename)
+    combined = pd.concat([existing[~existing[key].isin(df[key])], df], ignore_index=True)
+    if sort_by is not None:
+        combined = combined.sort_values(sort_by, kind='stable', ignore_index=True)
+    save_to_parquet(combined, filename, artifact)
+
+
+class RecordLog:
+    """Append-only log of scraped records, so a crash loses at most one batch.
+
+    Records are buffered and written to a JSON lines file `batch_size` at a time, each batch
+    fsynced before the next one starts. compact() folds the log into a Parquet file as new row
+    groups and empties it. After a crash the log still holds every flushed record, so the next run
+    can skip those urls and compact them together with its own.
+
+    `on_flush` is called with each batch once it is safely on disk.
+    """
+
+    def __init__(self, path, batch_size=25, on_flush=None):
+        self.path = path
+        self.batch_size = batch_size
+        self.on_flush = on_flush
+        self.buffer = []
+        self.flushed = sum(1 for _ in self.records())
+
+    def __len__(self):
+        return self.flushed + len(self.buffer)
+
+    def append(self, record):
+        self.buffer.append(record)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(''.join(json.dumps(record, default=str) + '\n' for record in self.buffer))
+            f.flush()
+            os.fsync(f.fileno())
+        self.flushed += len(self.buffer)
+        batch, self.buffer = self.buffer, []
+        if self.on_flush is not None:
+            self.on_flush(batch)
+
+    def records(self):
+        """Yield every flushed record."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # the last line of a log that was cut off mid-write
+                    continue
+
+    def urls(self):
+        return {record.get('url') for record in self.records()} | {record.get('url') for record in self.buffer}
+
+    def compact(self, filename, row_group_size=10000, run_id=None):
+        """Move every logged record into `filename` and empty the log; return the files written to.
+
+        `filename` can also be a PartitionedDataset (utils/dataset.py), which gets the records as new
+        files tagged with `run_id`; record those in the manifest (utils/manifest.py) right away, since
+        the run may not get to the end. Prefer that: a Parquet file is rewritten by every compaction
+        (see append_to_parquet), a dataset only gets the new records written.
+        """
+        self.flush()
+        partitioned = not isinstance(filename, str)
+        df = pd.DataFrame(list(self.records()))
+        if not df.empty and 'url' in df.columns:
+            ids = listing_ids(df['url'])
+            keep = ~pd.Series(ids).duplicated(keep='last').to_numpy()
+            # a crash between writing the Parquet file and emptying the log leaves records that were
+            # already moved, and they must not be added twice
+            keep &= ~np.isin(ids, filename.ids() if partitioned else ids_in_parquet(filename))
+            df = df[keep]
+        written = []
+        if not df.empty:
+            if partitioned:
+                written = filename.append(df, run_id=run_id)
+            else:
+                append_to_parquet(df, filename, row_group_size=row_group_size)
+                written = [filename]
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.flushed = 0
+        return written
+
+
+def load_row_groups_from(filename, start_row):
+    """Load the rows of a Parquet file from `start_row` onwards, reading only the row groups that hold them."""
+    if not os.path.exists(filename):
+        return pd.DataFrame()
+    parquet_file = pq.ParquetFile(filename)
+    groups, offset = [], 0
+    for i in range(parquet_file.num_row_groups):
+        rows = parquet_file.metadata.row_group(i).num_rows
+        if offset + rows > start_row:
+            groups.append(i)
+        offset += rows
+    df = parquet_file.read_row_groups(groups).to_pandas() if groups else parquet_file.schema_arrow.empty_table().to_pandas()
+    # the first group may start before start_row if the file was written some other way
+    skip = max(0, start_row - (offset - sum(parquet_file.metadata.row_group(i).num_rows for i in groups)))
+    return df.iloc[skip:].reset_index(drop=True)
@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# hemnet writes numbers the Swedish way: spaces (sometimes no-break spaces) between thousands, a
+# decimal comma and a unit after the number, e.g. "3 450 000 kr", "62,5 m²", "4,5 rum",
+# "5 163 kr/mån" or "+205 000 kr (+23 %)". parse_numbers() turns a whole column of those into
+# floats with two Arrow kernels: one that drops the thousands separators and one regex that picks
+# out the number. Categorical columns only have their categories parsed.
+#
+# Other string columns repeat a few thousand distinct values over all the rows; map_unique() runs a
+# transform on the distinct values only and spreads the results back through their codes.
+
+# kept here rather than in utils/dataset.py, so that this module only needs pandas and pyarrow and
+# the model code in src/ can use it without the dataset and storage modules
+SWEDISH_MONTHS = {
+    'januari': 1, 'februari': 2, 'mars': 3, 'april': 4, 'maj': 5, 'juni': 6,
+    'juli': 7, 'augusti': 8, 'september': 9, 'oktober': 10, 'november': 11, 'december': 12,
+}
+
+# regular, no-break and narrow no-break spaces
+THOUSANDS_SEPARATORS = r'[\s\x{00a0}\x{202f}]'
+
+# the number each kind of value starts with, once the separators are gone
+PATTERNS = {
+    # prices, fees and costs in whole kronor
+    'amount': r'(?P<number>[+-]?\d+)',
+    # areas and rooms, with a decimal comma
+    'decimal': r'(?P<number>[+-]?\d+(?:,\d+)?)',
+    # the first year of "1966" or "2019-2021"
+    'year': r'(?P<number>\d{1,4})',
+    # the percentage in "+205 000 kr (+23 %)"
+    'percent': r'(?P<number>[+-]?\d+(?:,\d+)?)%',
+}
+
+
+def parse_numbers(values, kind='amount'):
+    """Return a float64 Series with the number in every value of `values`, NaN where there is none.
+
+    `kind` is one of PATTERNS. Values that are already numeric are returned as floats.
+    """
+    values = pd.Series(values)
+    if pd.api.types.is_numeric_dtype(values.dtype):
+        return values.astype('float64')
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # every category is parsed once, then spread over the rows by its code
+        numbers = parse_numbers(values.cat.categories.to_series(), kind).to_numpy()
+        codes = values.cat.codes.to_numpy()
+        return pd.Series(np.where(codes >= 0, numbers[codes], np.nan), index=values.index, name=values.name)
+    try:
+        array = pa.array(values, from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # object columns mixing strings and numbers
+        values = values.astype(object)
+        array = pa.array(values.where(values.isna(), values.astype(str)), from_pandas=True)
+    numbers = _parse(array, kind)
+    return pd.Series(numbers.to_numpy(zero_copy_only=False), index=values.index, name=values.name, dtype='float64')
+
+
+def _parse(strings, kind):
+    if not pa.types.is_string(strings.type) and not pa.types.is_large_string(strings.type):
+        strings = strings.cast(pa.string())
+    joined = pc.replace_substring_regex(strings, THOUSANDS_SEPARATORS, '')
+    numbers = pc.struct_field(pc.extract_regex(joined, PATTERNS[kind]), 'number')
+    return pc.replace_substring(numbers, ',', '.').cast(pa.float64())
+
+
+def parse_columns(df, kinds):
+    """Parse the columns of `df` named in `kinds` ({column: kind}) in place; missing columns are skipped."""
+    for column, kind in kinds.items():
+        if column in df.columns:
+            df[column] = parse_numbers(df[column], kind)
+    return df
+
+
+def map_unique(values, func):
+    """Apply `func` to the distinct values of `values` only, and spread the result back over the rows.
+
+    `func` gets a Series of the distinct non-missing values and returns a Series or DataFrame with
+    one row for each, in the same order. The result has the index of `values`, and missing values
+    where `values` is missing. Columns like sale dates or floors have a few thousand distinct
+    values over hundreds of thousands of rows, so the string work shrinks by as much.
+    """
+    values = pd.Series(values)
+    codes, uniques = pd.factorize(values)
+    uniques = pd.Series(uniques)
+    if isinstance(uniques.dtype, pd.CategoricalDtype):
+        uniques = uniques.astype(uniques.dtype.categories.dtype)
+    result = func(uniques)
+    # one more row, of missing values, for the rows whose code is -1
+    result = result.reset_index(drop=True).reindex(range(len(uniques) + 1))
+    result = result.take(np.where(codes >= 0, codes, len(uniques)))
+    result.index = values.index
+    return result
+
+
+def parse_sale_dates(values):
+    """Return the datetime of every 'Såld 12 mars 2024' string, NaT where there is none."""
+    def parse(dates):
+        parts = dates.str.extract(r'(\d{1,2}) ([a-zåäö]+) (\d{4})')
+        return pd.to_datetime(pd.DataFrame({'year': pd.to_numeric(parts[2]),
+                                            'month': parts[1].str.lower().map(SWEDISH_MONTHS),
+                                            'day': pd.to_numeric(parts[0])}), errors='coerce')
+    return map_unique(values, parse)